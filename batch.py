@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 批量提问时同时进行的分析数量和每分钟最多发起的分析数量（0 表示不限制）
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_REQUESTS_PER_MINUTE = int(os.environ.get("BATCH_REQUESTS_PER_MINUTE", "0"))
+
+
+class RateLimiter:
+    """按固定间隔放行请求，使每分钟发起的请求数不超过上限，避免触发模型服务的限流"""
+
+    def __init__(self, requests_per_minute=0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def parse_questions(text):
+    """每行一个问题，忽略空行和重复的问题"""
+    questions = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and line not in questions:
+            questions.append(line)
+    return questions
+
+
+def run_batch(analyze, questions, concurrency=BATCH_CONCURRENCY, requests_per_minute=BATCH_REQUESTS_PER_MINUTE):
+    """并发执行 analyze(question)，按完成顺序产出 (序号, 问题, 结果)；总耗时约等于最慢的一批而不是所有问题之和
+
+    调用方中途停止迭代时，尚未开始的问题会被取消
+    """
+    limiter = RateLimiter(requests_per_minute)
+
+    def run(question):
+        limiter.acquire()
+        return analyze(question)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(run, question): (i, question) for i, question in enumerate(questions)}
+        for future in as_completed(futures):
+            i, question = futures[future]
+            yield i, question, future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,286 @@
+"""性能基准：生成不同规模的 CSV/XLSX/PDF/TXT 样例文件，测量加载耗时，并对本地模拟模型端到端运行 Agent
+
+用法：
+    python bench/benchmark.py --sizes 10000 100000 --repeat 3 --output bench_result.json
+
+每个加载用例在独立进程中运行，以便分别记录峰值内存；端到端部分使用 bench/mock_llm.py 按脚本回放工具调用，不消耗 token。
+所有缓存写在 --workdir 下，不影响项目目录中的缓存。
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# openpyxl 写入很慢，XLSX 样例的行数设上限
+XLSX_MAX_ROWS = 50000
+ROWS_PER_PDF_PAGE = 2000
+PDF_LINES_PER_PAGE = 60
+CACHE_DIRS = ('uploads', 'cache')
+# 端到端测试的问题：前两个可由快速路径直接计算，后两个需要调用 Agent
+QUESTIONS = ['各地区销售额总和', '销售额最高的10个产品', '分析销售额和数量之间的关系', '哪个地区的客户最多，原因可能是什么']
+# 模拟模型按顺序回放：先调用一次 pandas 工具，再给出最终答案
+SCRIPTED_REPLIES = [
+    'Thought: 先查看数据的规模和列\nAction: python_repl_ast\nAction Input: df.describe()',
+    'Thought: 已经得到答案\nFinal Answer: {"answer": "基准测试回答"}',
+]
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        '订单日期': pd.date_range('2023-01-01', periods=rows, freq='7min').strftime('%Y-%m-%d %H:%M'),
+        '地区': rng.choice(['华北', '华东', '华南', '西南', '东北'], rows),
+        '产品': rng.choice([f'P{i:03d}' for i in range(200)], rows),
+        '客户': rng.choice([f'C{i:05d}' for i in range(20000)], rows),
+        '销售额': np.round(rng.random(rows) * 1000, 2),
+        '数量': rng.integers(1, 50, rows),
+    })
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+    """写入只包含 ASCII 文本的最小 PDF，pages 为每页文本行的列表"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for lines in pages:
+        body = 'BT /F1 9 Tf 11 TL 40 800 Td ' + ' '.join(f'({_pdf_escape(line)}) Tj T*' for line in lines) + ' ET'
+        content = body.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objects))
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{i} 0 R' for i in page_ids).encode('ascii')
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids))
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def generate_fixtures(fixture_dir, sizes):
+    """按规模生成样例文件，已存在的文件直接复用，返回 [(格式, 行数, 路径)]"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    fixtures = []
+    for rows in sizes:
+        df = None
+        for file_type in ('csv', 'xlsx', 'pdf', 'txt'):
+            count = min(rows, XLSX_MAX_ROWS) if file_type == 'xlsx' else rows
+            path = os.path.join(fixture_dir, f'sales_{count}.{file_type}')
+            fixtures.append((file_type, count, path))
+            if os.path.exists(path):
+                continue
+            df = make_frame(rows) if df is None else df
+            if file_type == 'csv':
+                df.to_csv(path, index=False)
+            elif file_type == 'xlsx':
+                df.head(count).to_excel(path, index=False, sheet_name='sales')
+            elif file_type == 'txt':
+                df.to_csv(path, index=False, sep='\t')
+            else:
+                lines = [f'order {i}: region R{i % 5} product P{i % 200:03d} amount {v:.2f}'
+                         for i, v in enumerate(df['销售额'].head(rows // ROWS_PER_PDF_PAGE * PDF_LINES_PER_PAGE))]
+                write_pdf(path, [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+                          or [['empty']])
+    return fixtures
+
+
+def _clear_caches():
+    for name in CACHE_DIRS:
+        shutil.rmtree(name, ignore_errors=True)
+
+
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_load_case(file_path, file_type, mode, cold):
+    """执行一次加载，返回耗时、行数和进程的峰值内存"""
+    from loaders import load_dataset, parse_file
+    from query_engine import open_dataset
+    from storage import list_sheet_names, path_fingerprint
+
+    if cold:
+        _clear_caches()
+    sheet_name = list_sheet_names(file_path)[0] if file_type == 'xlsx' else None
+    # 模块导入本身占用的内存作为基线，单独统计加载带来的增长
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    fingerprint = path_fingerprint(file_path)
+    with redirect_stdout(sys.stderr):
+        if mode == 'duckdb':
+            dataset = open_dataset(file_path, file_type, fingerprint,
+                                   lambda: parse_file(file_path, file_type, sheet_name), sheet_name)
+            rows = dataset.num_rows
+        else:
+            rows = len(load_dataset(file_path, file_type, sheet_name, fingerprint,
+                                    document_mode=mode == 'document', lean=mode == 'lean'))
+    peak = _peak_rss_mb()
+    return {'seconds': time.perf_counter() - started, 'rows': rows, 'peak_rss_mb': peak,
+            'rss_growth_mb': peak - baseline}
+
+
+def load_cases(file_type):
+    if file_type == 'csv':
+        return [('pandas', True), ('pandas', False), ('lean', True), ('duckdb', True), ('duckdb', False)]
+    if file_type == 'xlsx':
+        return [('pandas', True), ('pandas', False), ('lean', True)]
+    return [('document', True), ('document', False)]
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype='float64')
+    if not len(values):
+        return {}
+    return {f'p{p}': float(np.percentile(values, p)) for p in (50, 90, 99)} | {'max': float(values.max())}
+
+
+def _run_in_subprocess(file_path, file_type, mode, cold):
+    """每个用例在新的 Python 进程中运行，峰值内存互不影响；缓存在磁盘上，因此“热”用例能命中前一个进程写入的缓存"""
+    case = json.dumps([file_path, file_type, mode, cold])
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', case],
+                               stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def bench_loading(fixtures, repeat):
+    results = []
+    for file_type, rows, path in fixtures:
+        for mode, cold in load_cases(file_type):
+            runs = [_run_in_subprocess(path, file_type, mode, cold) for _ in range(repeat)]
+            result = {'stage': 'load', 'format': file_type, 'rows': rows, 'mode': mode,
+                      'cache': 'cold' if cold else 'warm',
+                      'latency': percentiles([run['seconds'] for run in runs]),
+                      'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+                      'rss_growth_mb': max(run['rss_growth_mb'] for run in runs)}
+            results.append(result)
+            print(f"load  {file_type:<4} {rows:>8} 行  {mode:<8} {result['cache']:<4}  "
+                  f"p50 {result['latency']['p50']:.3f}s  p90 {result['latency']['p90']:.3f}s  "
+                  f"峰值内存 {result['peak_rss_mb']:.0f} MB（加载增加 {result['rss_growth_mb']:.0f} MB）", flush=True)
+    return results
+
+
+def bench_agent(file_path, questions, iterations, latency):
+    """对模拟模型端到端运行：统计每个问题的耗时、Agent 迭代次数、模型请求数和结果缓存命中率"""
+    from mock_llm import start_server
+
+    server = start_server(replies=SCRIPTED_REPLIES, latency=latency)
+    os.environ['LLM_BASE_URL'] = server.base_url
+    os.environ.setdefault('API_KEY', 'benchmark')
+
+    from langchain_core.callbacks import BaseCallbackHandler
+    from loaders import load_dataset
+    from result_cache import ResultCache
+    from storage import dataset_fingerprint, path_fingerprint
+    from utils import cached_dataframe_agent
+
+    class CountingCache(ResultCache):
+        hits = misses = 0
+
+        def get(self, key):
+            result = super().get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    class IterationCounter(BaseCallbackHandler):
+        def __init__(self):
+            self.iterations = 0
+            self.llm_calls = 0
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.llm_calls += 1
+
+        def on_agent_action(self, action, **kwargs):
+            self.iterations += 1
+
+    fingerprint = path_fingerprint(file_path)
+    df = load_dataset(file_path, 'csv', fingerprint=fingerprint)
+    data_fingerprint = dataset_fingerprint(fingerprint, None)
+    result_cache = CountingCache(os.path.join('cache', 'bench_results.sqlite3'))
+    latencies, agent_iterations = [], []
+    for _ in range(iterations):
+        for question in questions:
+            counter = IterationCounter()
+            started = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                cached_dataframe_agent(result_cache, df, question, data_fingerprint, callbacks=[counter])
+            latencies.append(time.perf_counter() - started)
+            # 只统计真正调用了模型的问题（未命中缓存和快速路径）
+            if counter.llm_calls:
+                agent_iterations.append(counter.iterations)
+    lookups = result_cache.hits + result_cache.misses
+    result = {'stage': 'agent', 'rows': len(df), 'questions': len(questions), 'iterations': iterations,
+              'latency': percentiles(latencies), 'agent_runs': len(agent_iterations),
+              'mean_agent_iterations': float(np.mean(agent_iterations)) if agent_iterations else 0.0,
+              'llm_requests': server.request_count, 'tcp_connections': server.connection_count,
+              'result_cache_hit_rate': result_cache.hits / lookups if lookups else 0.0,
+              'peak_rss_mb': _peak_rss_mb()}
+    server.shutdown()
+    print(f"agent {len(df):>8} 行  p50 {result['latency']['p50']:.3f}s  p90 {result['latency']['p90']:.3f}s  "
+          f"平均迭代 {result['mean_agent_iterations']:.2f}  模型请求 {result['llm_requests']}  "
+          f"结果缓存命中率 {result['result_cache_hit_rate']:.0%}", flush=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='加载与端到端分析的性能基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='样例数据的行数')
+    parser.add_argument('--repeat', type=int, default=3, help='每个加载用例重复的次数')
+    parser.add_argument('--iterations', type=int, default=3, help='端到端测试中问题列表重复的轮数，第二轮起命中结果缓存')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟模型每次请求的延迟（秒）')
+    parser.add_argument('--workdir', default=os.path.join(REPO_DIR, 'cache', 'bench'), help='样例文件和缓存目录')
+    parser.add_argument('--skip-load', action='store_true', help='只运行端到端测试')
+    parser.add_argument('--skip-agent', action='store_true', help='只运行加载测试')
+    parser.add_argument('--output', help='把结果写入 JSON 文件，便于比较不同版本')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_load_case(*json.loads(args.case))))
+        return
+
+    output = os.path.abspath(args.output) if args.output else None
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    fixtures = generate_fixtures('fixtures', sorted(args.sizes))
+    results = []
+    if not args.skip_load:
+        results += bench_loading(fixtures, args.repeat)
+    if not args.skip_agent:
+        _clear_caches()
+        smallest_csv = next(path for file_type, _, path in fixtures if file_type == 'csv')
+        results.append(bench_agent(smallest_csv, QUESTIONS, args.iterations, args.latency))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
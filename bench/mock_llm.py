@@ -0,0 +1,153 @@
+"""本地 OpenAI 兼容模拟服务，用于在不消耗 token 的情况下验证连接复用和 Agent 流程
+
+用法：
+    python bench/mock_llm.py --port 8765
+    LLM_BASE_URL=http://127.0.0.1:8765/v1 streamlit run main.py
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = 'Thought: 已经得到答案\nFinal Answer: {"answer": "模拟回答"}'
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """按顺序循环返回预设回复，并统计请求数与 TCP 连接数"""
+    daemon_threads = True
+
+    def __init__(self, address, replies=None, latency=0.0):
+        super().__init__(address, MockLLMHandler)
+        self.replies = itertools.cycle(replies or [DEFAULT_REPLY])
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.connection_count = 0
+
+    def next_reply(self):
+        with self.lock:
+            self.request_count += 1
+            return next(self.replies)
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/v1'
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    # 使用 HTTP/1.1 以支持 keep-alive，便于观察客户端是否复用连接
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, {'requests': self.server.request_count,
+                                  'connections': self.server.connection_count})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        reply = self.server.next_reply()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in request.get('messages', [])) // 4
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(reply) // 4,
+                 'total_tokens': prompt_tokens + len(reply) // 4}
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        if request.get('stream'):
+            self._send_stream(completion_id, request.get('model', 'mock'), reply, usage)
+            return
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+    def _send_stream(self, completion_id, model, reply, usage):
+        """以 SSE 分块返回回复，使用 chunked 编码以保持连接可复用"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_chunk(data):
+            body = data.encode('utf-8')
+            self.wfile.write(f'{len(body):X}\r\n'.encode('ascii') + body + b'\r\n')
+
+        pieces = [reply[i:i + 16] for i in range(0, len(reply), 16)] or ['']
+        for index, piece in enumerate(pieces):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': piece} if index == 0 else {'content': piece},
+                    'finish_reason': 'stop' if index == len(pieces) - 1 else None,
+                }],
+            }
+            if index == len(pieces) - 1:
+                chunk['usage'] = usage
+            write_chunk(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n')
+        write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def start_server(host='127.0.0.1', port=0, replies=None, latency=0.0):
+    """在后台线程中启动模拟服务并返回服务对象，port=0 时自动选择空闲端口"""
+    server = MockLLMServer((host, port), replies=replies, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='每次请求的模拟延迟（秒）')
+    parser.add_argument('--replies', help='JSON 文件，内容为按顺序循环返回的回复字符串列表')
+    args = parser.parse_args()
+
+    replies = None
+    if args.replies:
+        with open(args.replies, encoding='utf-8') as f:
+            replies = json.load(f)
+    server = MockLLMServer((args.host, args.port), replies=replies, latency=args.latency)
+    print(f'Mock LLM server listening on {server.base_url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""启动耗时回归检查：在全新进程中首次运行 main.py，测量到页面渲染完成的耗时和重新运行的耗时
+
+用法：
+    python bench/startup.py --repeat 5 --target 1.5
+
+同时检查首次运行后是否已经导入了只在具体功能中才用到的重量级依赖（绘图、模型客户端、文档解析等）。
+首次运行耗时的中位数超过 --target 秒，或提前导入了这些依赖时以退出码 1 结束，可作为 CI 中的回归检查。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(REPO_DIR, 'main.py')
+# 页面首次渲染时不应导入的模块，它们只在绘图、提问、解析文档等操作中才需要（pyarrow 由 pandas 自身导入，不在此列）
+LAZY_MODULES = ('matplotlib', 'langchain_openai', 'langchain_experimental', 'langchain_community',
+                'langchain.agents', 'langchain_text_splitters', 'openai', 'openpyxl', 'pypdf')
+DEFAULT_TARGET = 1.5
+
+
+def run_case(reruns):
+    """在当前（全新的）进程中运行 main.py 并输出 JSON 结果"""
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    streamlit_import = time.perf_counter() - started
+
+    app = AppTest.from_file(MAIN_SCRIPT, default_timeout=60)
+    started = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - started
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+
+    rerun_times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        rerun_times.append(time.perf_counter() - started)
+    loaded = sorted(name for name in LAZY_MODULES if name in sys.modules)
+    print(json.dumps({'streamlit_import': streamlit_import, 'first_run': first_run,
+                      'rerun': statistics.median(rerun_times) if rerun_times else 0.0, 'loaded': loaded}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量页面冷启动和重新运行的耗时')
+    parser.add_argument('--repeat', type=int, default=3, help='冷启动测量次数，每次使用新的进程')
+    parser.add_argument('--reruns', type=int, default=5, help='每次冷启动后重新运行页面的次数')
+    parser.add_argument('--target', type=float, default=DEFAULT_TARGET, help='首次运行耗时中位数的上限（秒）')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--case', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.reruns)
+        return 0
+
+    results = []
+    # 在临时目录中运行，页面创建的上传和缓存目录不会写入项目目录
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(args.repeat):
+            command = [sys.executable, os.path.abspath(__file__), '--case', '--reruns', str(args.reruns)]
+            completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True)
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    summary = {key: round(statistics.median(result[key] for result in results), 3)
+               for key in ('streamlit_import', 'first_run', 'rerun')}
+    summary['loaded'] = sorted({name for result in results for name in result['loaded']})
+    summary['target'] = args.target
+    print(f"导入 Streamlit {summary['streamlit_import']:.3f}s  首次运行 {summary['first_run']:.3f}s  "
+          f"重新运行 {summary['rerun']:.3f}s  目标 {args.target:.3f}s")
+    if summary['loaded']:
+        print('首次运行时已导入：' + ', '.join(summary['loaded']))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 1 if summary['first_run'] > args.target or summary['loaded'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
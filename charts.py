@@ -0,0 +1,109 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+# 折线图最多绘制的点数，超出时用 LTTB 降采样
+MAX_LINE_POINTS = 1000
+# 柱状图和饼图最多显示的类别数，其余合并为“其他”
+MAX_BAR_CATEGORIES = 30
+MAX_PIE_SLICES = 8
+OTHER_LABEL = '其他'
+CHART_COLORS = ['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe']
+CHART_DPI = 100
+MAX_X_TICKS = 20
+CHART_FONTS = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
+
+
+def lttb(values, threshold):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的下标，能保住折线的峰谷形状"""
+    length = len(values)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    y = np.nan_to_num(np.asarray(values, dtype='float64'))
+    x = np.arange(length, dtype='float64')
+    # 首尾两点固定保留，中间的点均分为 threshold - 2 个桶
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    selected = [0]
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else length
+        if next_end <= next_start:
+            next_end = next_start + 1
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # 选出与上一个保留点、下一个桶均值构成三角形面积最大的点
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected.append(previous)
+    selected.append(length - 1)
+    return np.asarray(selected)
+
+
+def top_n(labels, values, n):
+    """只保留数值最大的 n - 1 个类别（保持原有顺序），其余合并为“其他”"""
+    if len(values) <= n:
+        return labels, values
+    order = np.argsort(-np.nan_to_num(values), kind='stable')
+    keep = np.sort(order[:n - 1])
+    rest = np.delete(np.arange(len(values)), keep)
+    return ([labels[i] for i in keep] + [OTHER_LABEL],
+            np.append(values[keep], np.nansum(values[rest])))
+
+
+def prepare_chart_data(input_data, chart_type):
+    """把 Agent 返回的图表数据整理为 (标签列表, 数值数组)，点数过多时先降采样或合并"""
+    labels = [str(label) for label in input_data["columns"]]
+    values = pd.to_numeric(pd.Series(input_data["data"]), errors='coerce').to_numpy(dtype='float64')
+    # 【修复】缺失值和无穷大无法绘制（饼图会直接出错，折线图和柱状图会被当作 0），绘图前去掉这些点
+    finite = np.isfinite(values)
+    if not finite.all():
+        labels = [label for label, keep in zip(labels, finite) if keep]
+        values = values[finite]
+    if chart_type == "折线图":
+        keep = lttb(values, MAX_LINE_POINTS)
+        return [labels[i] for i in keep], values[keep]
+    if chart_type == "柱状图":
+        return top_n(labels, values, MAX_BAR_CATEGORIES)
+    return top_n(labels, values, MAX_PIE_SLICES)
+
+
+def chart_frame(labels, values):
+    """供 Streamlit 内置图表在浏览器端绘制的数据表"""
+    return pd.DataFrame({"x": labels, "y": values}).set_index("x")
+
+
+def render_chart(labels, values, chart_type):
+    """在服务端把图表绘制为 PNG 字节；使用独立的 Figure 对象而非 pyplot，绘制结束即可被回收"""
+    # matplotlib 导入较慢，只在第一次绘制静态图表时导入
+    from matplotlib import style
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    # 【修复】seaborn 样式会覆盖中文字体设置，这里在样式之后重新指定中文字体
+    with style.context(['seaborn-v0_8', {'font.sans-serif': CHART_FONTS, 'axes.unicode_minus': False}]):
+        if chart_type == "饼图":
+            fig = Figure(figsize=(8, 8), dpi=CHART_DPI)
+            ax = fig.subplots()
+            ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90, colors=CHART_COLORS,
+                   explode=[0.05] * len(values))
+            ax.set_title('数据分布图', fontsize=16, fontweight='bold', pad=20)
+        else:
+            fig = Figure(figsize=(10, 6), dpi=CHART_DPI)
+            ax = fig.subplots()
+            if chart_type == "柱状图":
+                ax.bar(labels, values, color=CHART_COLORS, alpha=0.8, edgecolor='white', linewidth=2)
+            else:
+                ax.plot(labels, values, color=CHART_COLORS[0], linewidth=2)
+                # 点数很多时只标注部分刻度，避免逐个绘制上千个标签
+                ax.xaxis.set_major_locator(MaxNLocator(MAX_X_TICKS))
+            ax.set_title('数据分析结果', fontsize=16, fontweight='bold', pad=20)
+            ax.grid(True, alpha=0.3)
+            ax.tick_params(axis='x', labelrotation=45)
+            for label in ax.get_xticklabels():
+                label.set_horizontalalignment('right')
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+    fig.clear()
+    return buffer.getvalue()
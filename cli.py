@@ -0,0 +1,150 @@
+"""命令行入口：不启动 Streamlit，对一个或多个文件批量提问并把结果写为 JSON
+
+    API_KEY=... python cli.py sales.xlsx report.csv -q "各地区销售额总和" --queries questions.txt -o results/
+
+配置优先读取环境变量，也可以用 --config 指定 TOML 或 JSON 文件（键名与环境变量相同，如 API_KEY、LLM_MODEL）。
+--workers 大于 1 时每个文件在独立进程中处理，适合夜间离线跑大量文件。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+LOAD_MODES = ('auto', 'pandas', 'lean', 'duckdb', 'document')
+
+
+def load_config(path):
+    """读取配置文件并写入环境变量，已设置的环境变量优先"""
+    with open(path, 'rb') as f:
+        config = json.load(f) if path.endswith('.json') else tomllib.load(f)
+    for key, value in config.items():
+        os.environ.setdefault(str(key), str(value))
+
+
+def open_analysis_data(file_path, file_type, fingerprint, mode, sheet_name=None):
+    """按加载方式打开数据，返回 (交给 Agent 的数据, 数据集指纹)，与页面上的加载流程一致"""
+    from loaders import DOCUMENT_TYPES, TABLE_TYPES, load_dataset, parse_file
+    from query_engine import open_dataset
+    from retrieval import load_index
+    from storage import dataset_fingerprint
+
+    if mode == 'auto':
+        mode = 'document' if file_type in DOCUMENT_TYPES else 'pandas'
+    if mode == 'document' and file_type in DOCUMENT_TYPES:
+        chunks = load_dataset(file_path, file_type, sheet_name, fingerprint, document_mode=True)
+        return load_index(fingerprint, chunks), dataset_fingerprint(fingerprint, sheet_name, 'chunks')
+    if mode == 'duckdb' and file_type in TABLE_TYPES:
+        dataset = open_dataset(file_path, file_type, fingerprint,
+                               lambda: parse_file(file_path, file_type, sheet_name), sheet_name)
+        return dataset, dataset_fingerprint(fingerprint, sheet_name)
+    lean = mode == 'lean' and file_type in TABLE_TYPES
+    df = load_dataset(file_path, file_type, sheet_name, fingerprint, lean=lean)
+    return df, dataset_fingerprint(fingerprint, sheet_name, *(('lean',) if lean else ()))
+
+
+def analyze_file(file_path, questions, mode='auto', sheet_name=None, concurrency=None, requests_per_minute=None):
+    """加载一个文件并回答所有问题，返回可直接写为 JSON 的结果；Agent 的过程日志输出到 stderr"""
+    from batch import BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE, run_batch
+    from result_cache import ResultCache
+    from storage import list_sheet_names, path_fingerprint
+    from tracing import start_trace
+    from utils import cached_dataframe_agent
+
+    started = time.monotonic()
+    file_type = os.path.splitext(file_path)[1].lstrip('.').lower()
+    output = {"file": file_path, "sheet": sheet_name, "mode": mode}
+    try:
+        with redirect_stdout(sys.stderr):
+            if file_type in ('xlsx', 'xls') and sheet_name is None:
+                sheet_name = output["sheet"] = list_sheet_names(file_path)[0]
+            fingerprint = path_fingerprint(file_path)
+            data, data_fingerprint = open_analysis_data(file_path, file_type, fingerprint, mode, sheet_name)
+            result_cache = ResultCache()
+            results = [None] * len(questions)
+
+            def analyze(question):
+                with start_trace('analysis', query=question, file=file_path):
+                    return cached_dataframe_agent(result_cache, data, question, data_fingerprint)
+
+            for i, question, result in run_batch(
+                    analyze,
+                    questions,
+                    BATCH_CONCURRENCY if concurrency is None else concurrency,
+                    BATCH_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute):
+                results[i] = {"query": question, "result": result}
+        output["results"] = results
+    except Exception as e:
+        output["error"] = f"{type(e).__name__}: {e}"
+    output["elapsed"] = round(time.monotonic() - started, 3)
+    return output
+
+
+def write_output(output, output_dir):
+    """写入 <输出目录>/<文件名>[_<工作表>].json，未指定目录时以 JSON Lines 输出到 stdout"""
+    text = json.dumps(output, ensure_ascii=False, indent=None if output_dir is None else 2)
+    if output_dir is None:
+        print(text, flush=True)
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(output["file"]))[0]
+    if output.get("sheet"):
+        name = f'{name}_{output["sheet"]}'
+    with open(os.path.join(output_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def read_questions(args):
+    questions = list(args.query or [])
+    if args.queries:
+        from batch import parse_questions
+        with open(args.queries, encoding='utf-8') as f:
+            questions += parse_questions(f.read())
+    return list(dict.fromkeys(questions))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='不启动页面，直接对文件批量提问并输出 JSON 结果')
+    parser.add_argument('files', nargs='+', help='要分析的 Excel/CSV/PDF/DOCX/TXT/MD 文件')
+    parser.add_argument('-q', '--query', action='append', help='问题，可重复指定')
+    parser.add_argument('--queries', help='问题文件，每行一个问题')
+    parser.add_argument('--sheet', help='Excel 工作表名称，默认第一个工作表')
+    parser.add_argument('--mode', choices=LOAD_MODES, default='auto',
+                        help='加载方式：auto 时文档使用检索模式、表格使用常规模式')
+    parser.add_argument('-o', '--output', help='结果输出目录，不指定时以 JSON Lines 输出到 stdout')
+    parser.add_argument('--config', help='TOML 或 JSON 配置文件，键名与环境变量相同')
+    parser.add_argument('--concurrency', type=int, help='每个文件同时分析的问题数')
+    parser.add_argument('--rate', type=int, help='每个进程每分钟最多发起的分析数，0 为不限制')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理文件的进程数')
+    args = parser.parse_args(argv)
+
+    if args.config:
+        load_config(args.config)
+    questions = read_questions(args)
+    if not questions:
+        parser.error('请通过 -q 或 --queries 指定至少一个问题')
+
+    jobs = [(path, questions, args.mode, args.sheet, args.concurrency, args.rate) for path in args.files]
+    failed = 0
+    if args.workers > 1 and len(jobs) > 1:
+        # 子进程使用 spawn 启动，继承上面写入的环境变量配置
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(analyze_file, *job) for job in jobs]
+            for future in as_completed(futures):
+                output = future.result()
+                failed += "error" in output
+                write_output(output, args.output)
+    else:
+        for job in jobs:
+            output = analyze_file(*job)
+            failed += "error" in output
+            write_output(output, args.output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
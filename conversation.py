@@ -0,0 +1,93 @@
+"""连续对话：在一个会话内保留最近几轮提问的精简过程和结果，以及分析过程中生成的中间 DataFrame
+
+追问时这些中间结果作为变量放回代码执行环境，历史以文本形式拼接在提示词中数据集摘要之后，
+“再按地区拆分一下”之类的问题无需重新筛选、汇总一遍数据。
+"""
+import json
+import threading
+from collections import OrderedDict, deque
+
+import pandas as pd
+
+# 保留的历史轮数、中间结果个数以及单个中间结果的最大行数
+CONVERSATION_TURNS = 6
+CONVERSATION_FRAMES = 8
+CONVERSATION_FRAME_ROWS = 10000
+# 历史中每段代码、每次查询输出和每个结果保留的最大字符数
+HISTORY_CODE_CHARS = 300
+HISTORY_OUTPUT_CHARS = 300
+HISTORY_RESULT_CHARS = 500
+# 描述中间结果时最多列出的列名数
+FRAME_COLUMNS_SHOWN = 10
+
+
+def _truncate(text, limit):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def _condense_code(code):
+    """多行代码合并为一行，以分号分隔"""
+    return _truncate("; ".join(line.strip() for line in str(code).strip().splitlines() if line.strip()),
+                     HISTORY_CODE_CHARS)
+
+
+def describe_frame(name, frame):
+    if isinstance(frame, pd.Series):
+        return f"- `{name}`：Series，{len(frame)} 行"
+    columns = [str(column) for column in frame.columns[:FRAME_COLUMNS_SHOWN]]
+    more = f" 等 {len(frame.columns)} 列" if len(frame.columns) > FRAME_COLUMNS_SHOWN else ""
+    return f"- `{name}`：DataFrame，{len(frame)} 行，列：{', '.join(columns)}{more}"
+
+
+class Conversation:
+    """一个会话中针对同一数据集的多轮提问，历史轮数和中间结果的个数、大小都有上限"""
+
+    def __init__(self, data_fingerprint=None):
+        self.data_fingerprint = data_fingerprint
+        self.turns = deque(maxlen=CONVERSATION_TURNS)
+        self.frames = OrderedDict()
+        self._turn_count = 0
+        self._lock = threading.Lock()
+
+    def add_turn(self, question, result, steps=(), frames=None):
+        """记录一轮提问：steps 为 (执行的代码, 输出) 列表，frames 为本轮新生成的中间结果"""
+        with self._lock:
+            self._turn_count += 1
+            self.turns.append({
+                "number": self._turn_count,
+                "question": question,
+                "steps": [(_condense_code(code), _truncate(output, HISTORY_OUTPUT_CHARS)) for code, output in steps],
+                "result": _truncate(json.dumps(result, ensure_ascii=False), HISTORY_RESULT_CHARS),
+            })
+            for name, frame in (frames or {}).items():
+                if len(frame) <= CONVERSATION_FRAME_ROWS:
+                    self.frames.pop(name, None)
+                    self.frames[name] = frame
+            while len(self.frames) > CONVERSATION_FRAMES:
+                self.frames.popitem(last=False)
+
+    def history(self):
+        """精简的对话历史
+
+        每一轮只在末尾追加、轮次编号不变，可变的中间结果列表放在最后，模型服务可以缓存前面不变的提示词前缀
+        """
+        with self._lock:
+            if not self.turns:
+                return ""
+            lines = ["以下是本次对话中之前的提问和分析过程，当前问题可能是对它们的追问："]
+            for turn in self.turns:
+                lines.append(f"第 {turn['number']} 轮提问：{turn['question']}")
+                for code, output in turn["steps"]:
+                    lines.append(f"  执行：{code}")
+                    lines.append(f"  输出：{output}")
+                lines.append(f"  结果：{turn['result']}")
+            if self.frames:
+                lines.append("之前生成的以下中间结果已作为变量保留，可以在代码中直接使用，无需重新计算：")
+                lines.extend(describe_frame(name, frame) for name, frame in self.frames.items())
+            return "\n".join(lines) + "\n\n"
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.frames.clear()
@@ -0,0 +1,128 @@
+import codecs
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from charset_normalizer import from_bytes
+from langchain_core.documents import Document
+
+from storage import atomic_write
+
+# 逐页文本缓存目录：cache/pages/<文件指纹>/<页码>.txt
+PAGE_CACHE_DIR = os.path.join('cache', 'pages')
+PAGE_BATCH_SIZE = 8
+# 页数不超过该值时直接在当前线程提取，省去进程池的调度开销
+MIN_PAGES_FOR_POOL = PAGE_BATCH_SIZE * 2
+ENCODING_PREFIX_BYTES = 64 * 1024
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """进程池在首次使用时创建并常驻复用；使用 spawn 避免在多线程的 Streamlit 进程中 fork"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def _page_dir(fingerprint):
+    return os.path.join(PAGE_CACHE_DIR, fingerprint)
+
+
+def _page_path(fingerprint, page):
+    return os.path.join(_page_dir(fingerprint), f'{page}.txt')
+
+
+def _done_path(fingerprint):
+    return os.path.join(_page_dir(fingerprint), 'done')
+
+
+def _write_page(fingerprint, page, text):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    atomic_write(_page_path(fingerprint, page), write)
+
+
+def _read_page(fingerprint, page):
+    with open(_page_path(fingerprint, page), encoding='utf-8') as f:
+        return f.read()
+
+
+def _extract_pdf_batch(file_path, pages):
+    """在工作进程中提取一批页面的文本"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [(page, reader.pages[page].extract_text()) for page in pages]
+
+
+def is_extracted(fingerprint):
+    """该文件的所有页面是否都已提取并缓存"""
+    return os.path.exists(_done_path(fingerprint))
+
+
+def iter_pdf_pages(file_path, fingerprint, page_count):
+    """逐页产出 (页码, 文本)：已缓存的页直接读取，其余页分批并行提取，按完成顺序产出并写入缓存"""
+    os.makedirs(_page_dir(fingerprint), exist_ok=True)
+    missing = []
+    for page in range(page_count):
+        if os.path.exists(_page_path(fingerprint, page)):
+            yield page, _read_page(fingerprint, page)
+        else:
+            missing.append(page)
+
+    batches = [missing[i:i + PAGE_BATCH_SIZE] for i in range(0, len(missing), PAGE_BATCH_SIZE)]
+    # 【修复】在子进程（如命令行 --workers）中直接在当前进程提取：文件已在进程间并行，
+    # 且子进程退出时不会关闭常驻进程池，会一直等待池中空闲的工作进程而无法退出
+    if len(missing) <= MIN_PAGES_FOR_POOL or multiprocessing.parent_process() is not None:
+        results = (_extract_pdf_batch(file_path, batch) for batch in batches)
+    else:
+        pool = _get_process_pool()
+        futures = [pool.submit(_extract_pdf_batch, file_path, batch) for batch in batches]
+        results = (future.result() for future in as_completed(futures))
+    for batch_result in results:
+        for page, text in batch_result:
+            _write_page(fingerprint, page, text)
+            yield page, text
+
+    with open(_done_path(fingerprint), 'w') as f:
+        f.write(str(page_count))
+
+
+def load_pdf_pages(file_path, fingerprint, on_page=None):
+    """按页提取 PDF 并返回按页码排序的 Document 列表，on_page(页码, 文本, 已完成页数, 总页数) 用于展示进度"""
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(file_path).pages)
+    texts = {}
+    for page, text in iter_pdf_pages(file_path, fingerprint, page_count):
+        texts[page] = text
+        if on_page is not None:
+            on_page(page, text, len(texts), page_count)
+    return [Document(page_content=texts[page], metadata={'source': file_path, 'page': page})
+            for page in sorted(texts)]
+
+
+def detect_encoding(file_path, size=ENCODING_PREFIX_BYTES):
+    """只读取文件开头的 size 字节来判断文本编码，size 为 None 时读取整个文件"""
+    with open(file_path, 'rb') as f:
+        prefix = f.read(-1 if size is None else size)
+    if prefix.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # 增量解码，允许截断在多字节字符中间
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    best = from_bytes(prefix).best()
+    # 无法判断时回退到 GBK，它在中国很常用
+    return best.encoding if best is not None else 'gbk'
@@ -0,0 +1,271 @@
+import json
+import re
+import unicodedata
+
+import pandas as pd
+
+# 聚合关键词：(关键词, pandas 聚合函数, 回答中使用的名称)
+AGGREGATIONS = [
+    (('总和', '合计', '总计', '总额', '求和', '汇总', 'sum', 'total'), 'sum', '总和'),
+    (('平均值', '平均数', '平均', '均值', 'mean', 'average', 'avg'), 'mean', '平均值'),
+    (('中位数', 'median'), 'median', '中位数'),
+    (('最大值', '最大', '最高', 'max'), 'max', '最大值'),
+    (('最小值', '最小', '最低', 'min'), 'min', '最小值'),
+    (('多少行', '行数', '记录数', '条数', '计数', '数量', '个数', 'count'), 'count', '数量'),
+]
+CHART_KEYWORDS = [
+    (('柱状图', '条形图', '柱形图', 'bar chart', 'bar'), 'bar'),
+    (('折线图', '趋势图', '趋势', '走势', 'line chart', 'line'), 'line'),
+    (('饼图', '饼状图', '占比', 'pie chart', 'pie'), 'pie'),
+]
+# 时间粒度关键词：(关键词, pandas Period 频率)
+PERIODS = [
+    (('按年', '每年', '年度', '逐年', 'yearly', 'by year', 'per year'), 'Y'),
+    (('按季度', '每季度', '季度', 'quarterly', 'by quarter'), 'Q'),
+    (('按月', '每月', '月度', '逐月', '每个月', 'monthly', 'by month', 'per month'), 'M'),
+    (('按周', '每周', '逐周', 'weekly', 'by week', 'per week'), 'W'),
+    (('按天', '按日', '每天', '每日', '逐日', 'daily', 'by day', 'per day'), 'D'),
+]
+GROUP_MARKERS = ('按照', '根据', '按', '各个', '各', '每个', '每', 'group by', 'by', 'per', 'for each', 'each')
+TOP_PATTERN = re.compile(r'(?:top|前|最高的?|最大的?|最多的?)\s*(\d+|[一二三四五六七八九十两]+)')
+BOTTOM_PATTERN = re.compile(r'(?:bottom|后|最低的?|最小的?|最少的?)\s*(\d+|[一二三四五六七八九十两]+)')
+CHINESE_DIGITS = {'一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+# 识别出的列名和关键词之外允许出现的虚词，其余内容一律视为无法识别并交给 Agent
+STOP_WORDS = ('请', '一共', '总共', '共', '有', '帮我', '帮忙', '给我', '一下', '计算', '统计', '求', '查询', '查看', '显示', '展示', '列出', '给出',
+              '生成', '画', '绘制', '做', '是', '多少', '什么', '的', '了', '吗', '呢', '个', '条', '名', '列', '字段',
+              '数据', '所有', '全部', '分组', '分别', '排名', '排序', '和', '及', '与', '中', '里', '在', '值', '图',
+              'what', 'is', 'the', 'of', 'show', 'me', 'give', 'list', 'please', 'calculate', 'compute', 'get',
+              'a', 'an', 'in', 'for', 'rows', 'and', 'chart', 'plot', 'draw', 'values', 'value')
+# 识别之外只允许剩下这些标点；数字、百分号、运算符、“年/月/倍”等都可能是筛选或计算条件，不能忽略
+IGNORED_PUNCTUATION = '?？。.!！,，、:：;；"“”\'‘’'
+MAX_GROUPS = 200
+DATE_MIN_PARSE_RATIO = 0.95
+RESULT_DECIMALS = 4
+
+
+def _normalize(text):
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def _parse_number(text):
+    if text.isdigit():
+        return int(text)
+    # 只处理一到九十九的中文数字
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return CHINESE_DIGITS.get(tens, 1) * 10 + CHINESE_DIGITS.get(ones, 0)
+    return CHINESE_DIGITS.get(text)
+
+
+def _find(text, keywords):
+    """返回第一个出现在问题中的关键词（按给定顺序，长词在前）"""
+    for keyword in keywords:
+        if _contains(text, keyword):
+            return keyword
+    return None
+
+
+def _contains(text, word):
+    if word.isascii():
+        return re.search(r'(?<![a-z0-9_])' + re.escape(word) + r'(?![a-z0-9_])', text) is not None
+    return word in text
+
+
+def _remove(text, word):
+    if word.isascii():
+        return re.sub(r'(?<![a-z0-9_])' + re.escape(word) + r'(?![a-z0-9_])', ' ', text)
+    return text.replace(word, ' ')
+
+
+def _match_columns(df, text):
+    """找出问题中提到的列，较长的列名优先匹配，返回 (列名, 出现位置) 列表和去掉列名后的文本"""
+    mentions = []
+    for column in sorted(df.columns, key=lambda c: len(str(c)), reverse=True):
+        name = _normalize(str(column)).strip()
+        if not name:
+            continue
+        if name.isascii():
+            match = re.search(r'(?<![a-z0-9_])' + re.escape(name) + r'(?![a-z0-9_])', text)
+        else:
+            match = re.search(re.escape(name), text)
+        if match is None:
+            continue
+        mentions.append((column, match.start()))
+        # 用占位符替换，避免较短的列名再次匹配到同一段文字
+        text = text[:match.start()] + '\0' * len(name) + text[match.end():]
+    mentions.sort(key=lambda item: item[1])
+    return mentions, text
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def _as_datetime(series):
+    """把列转换为日期，无法可靠转换时返回 None"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return None
+    parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+    if parsed.notna().sum() < DATE_MIN_PARSE_RATIO * series.notna().sum():
+        return None
+    return parsed
+
+
+def _to_payload(frame):
+    """把结果 DataFrame 转换为与 Agent 输出相同的 JSON 结构中的 columns/data"""
+    payload = json.loads(frame.to_json(orient='split', index=False, date_format='iso', force_ascii=False))
+    return {"columns": [str(c) for c in payload["columns"]], "data": payload["data"]}
+
+
+def _chart_payload(series):
+    payload = json.loads(series.to_json(orient='split', date_format='iso', force_ascii=False))
+    return {"columns": [str(label) for label in payload["index"]], "data": payload["data"]}
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f'{value:,.2f}'.rstrip('0').rstrip('.')
+    return f'{value:,}' if isinstance(value, int) else str(value)
+
+
+def _aggregate(grouped, how, value_column):
+    if value_column is None:
+        return grouped.size()
+    return grouped[value_column].agg(how).round(RESULT_DECIMALS)
+
+
+def answer_simple_query(df, query):
+    """识别“总和 / 平均值 / 前 N / 按某列分组 / 按月趋势”等常见问题并直接用 pandas 计算
+
+    返回与 Agent 相同结构的结果字典；问题中有无法识别的内容或列匹配不唯一时返回 None，交给 Agent 处理
+    """
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    if not df.columns.is_unique:
+        return None
+    text = _normalize(query)
+    mentions, residual = _match_columns(df, text)
+
+    # 先识别“前 N / 最高的 N”，避免其中的“最高”被当作求最大值
+    top = TOP_PATTERN.search(residual)
+    bottom = BOTTOM_PATTERN.search(residual)
+    limit_match = top or bottom
+    if limit_match:
+        residual = residual.replace(limit_match.group(0), ' ')
+    aggregation = next(((how, label, keyword) for keywords, how, label in AGGREGATIONS
+                        if (keyword := _find(residual, keywords))), None)
+    chart = next(((kind, keyword) for keywords, kind in CHART_KEYWORDS if (keyword := _find(residual, keywords))),
+                 None)
+    period = next(((freq, keyword) for keywords, freq in PERIODS if (keyword := _find(residual, keywords))), None)
+
+    # 分组列：紧跟在“按 / 各 / 每个 / by”之后提到的列；“top 10 by 销售额”中的 by 指排序依据，不是分组
+    group_column = None
+    if limit_match is None:
+        for column, position in mentions:
+            before = text[:position].rstrip()
+            if any(before.endswith(marker) for marker in GROUP_MARKERS):
+                group_column = column
+                break
+
+    # 去掉所有已识别的部分，还有剩余内容说明问题超出了能力范围
+    for found in (aggregation and aggregation[2], chart and chart[1], period and period[1]):
+        if found:
+            residual = _remove(residual, found)
+    for marker in GROUP_MARKERS + STOP_WORDS:
+        residual = _remove(residual, marker)
+    # 【修复】数字和运算符不再忽略，否则“2023年销售额总和”“销售额总和的2倍”会被当作全表总和
+    residual = re.sub(r'[\s\0]', '', residual)
+    if residual.strip(IGNORED_PUNCTUATION):
+        return None
+
+    others = [column for column, _ in mentions if column != group_column]
+    numeric = [column for column in others if _is_numeric(df[column])]
+    if len(numeric) > 1 or len(others) - len(numeric) > 1:
+        return None
+    value_column = numeric[0] if numeric else None
+    label_column = next((column for column in others if column not in numeric), None)
+    how, how_label = (aggregation[0], aggregation[1]) if aggregation else ('sum', '总和')
+    if how == 'count':
+        value_column = None
+
+    if period is not None:
+        if group_column is not None:
+            return None
+        return _period_trend(df, period[0], how, how_label, value_column, label_column, chart)
+    if limit_match is not None:
+        if value_column is None:
+            if label_column is None:
+                return None
+            # “最多的 N 个产品”没有数值列时按出现次数排名
+            how = 'count'
+        return _top_n(df, limit_match, top is not None, how, value_column, label_column, chart)
+    if group_column is None and label_column is not None and chart is not None:
+        # “各产品销售额的柱状图”这类问题中，非数值列即为分组依据
+        group_column, label_column = label_column, None
+    if label_column is not None:
+        return None
+    if group_column is not None:
+        return _group_by(df, group_column, how, how_label, value_column, chart)
+    if aggregation is None or chart is not None:
+        return None
+    if value_column is None:
+        if how != 'count' or mentions:
+            return None
+        return {"answer": f"数据共有 {len(df):,} 行"}
+    value = df[value_column].agg(how)
+    if pd.isna(value):
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    return {"answer": f"{value_column}的{how_label}为 {_format_value(value)}"}
+
+
+def _group_by(df, group_column, how, how_label, value_column, chart):
+    if value_column is None and how != 'count':
+        return None
+    result = _aggregate(df.groupby(group_column, observed=True, sort=True), how, value_column)
+    if len(result) > MAX_GROUPS:
+        return None
+    if chart is not None:
+        return {chart[0]: _chart_payload(result)}
+    name = f'{value_column}{how_label}' if value_column is not None else how_label
+    return {"table": _to_payload(result.rename(name).reset_index())}
+
+
+def _period_trend(df, freq, how, how_label, value_column, label_column, chart):
+    """按时间粒度汇总，默认以折线图展示"""
+    date_column = label_column
+    if date_column is None:
+        candidates = [column for column in df.columns if pd.api.types.is_datetime64_any_dtype(df[column])]
+        if len(candidates) != 1:
+            return None
+        date_column = candidates[0]
+    dates = _as_datetime(df[date_column])
+    if dates is None or (value_column is None and how != 'count'):
+        return None
+    periods = dates.dt.to_period(freq).rename(date_column)
+    result = _aggregate(df.groupby(periods, sort=True), how, value_column)
+    if len(result) > MAX_GROUPS * 5:
+        return None
+    result.index = result.index.astype(str)
+    kind = chart[0] if chart is not None else 'line'
+    return {kind: _chart_payload(result)}
+
+
+def _top_n(df, limit_match, largest, how, value_column, label_column, chart):
+    n = _parse_number(limit_match.group(1))
+    if not n or n > MAX_GROUPS:
+        return None
+    if label_column is not None:
+        # 同一标签可能出现多行，先按标签汇总再排名；“最多的 N 个”按出现次数排名
+        values = _aggregate(df.groupby(label_column, observed=True), how, value_column)
+        ranked = values.nlargest(n) if largest else values.nsmallest(n)
+        if chart is not None:
+            return {chart[0]: _chart_payload(ranked)}
+        return {"table": _to_payload(ranked.rename(value_column or '数量').reset_index())}
+    if chart is not None:
+        return None
+    ranked = df.nlargest(n, value_column) if largest else df.nsmallest(n, value_column)
+    return {"table": _to_payload(ranked)}
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from extraction import detect_encoding
+
+# pyarrow 分块读取 CSV 时每块的字节数
+CSV_BLOCK_SIZE = 8 << 20
+# 唯一值占比不超过该值的字符串列转换为 category
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MAX_UNIQUE = 65535
+DATE_SAMPLE_SIZE = 1000
+DATE_PATTERN = r'\d{1,4}[-/.年]\d{1,2}'
+# 样本中至少这么多比例的值能被解析为日期时，才把整列转换为日期
+DATE_MIN_PARSE_RATIO = 0.95
+# 用 pd.read_csv 实际读取前多少行来测算默认加载方式的内存占用
+BASELINE_SAMPLE_ROWS = 10000
+
+_INT_TYPES = [(pa.int8(), np.int8), (pa.int16(), np.int16), (pa.int32(), np.int32), (pa.int64(), np.int64)]
+_UINT_TYPES = [(pa.uint8(), np.uint8), (pa.uint16(), np.uint16), (pa.uint32(), np.uint32), (pa.uint64(), np.uint64)]
+
+
+def _smallest_int_type(min_value, max_value):
+    candidates = _UINT_TYPES if min_value >= 0 else _INT_TYPES
+    for arrow_type, numpy_type in candidates:
+        info = np.iinfo(numpy_type)
+        if info.min <= min_value and max_value <= info.max:
+            return arrow_type
+    return pa.int64()
+
+
+def _measure_default_memory(file_path, encoding, num_rows):
+    """默认方式（pd.read_csv）加载后 DataFrame 的内存占用，用于对比节省的内存
+
+    【修复】不再按类型估算（中文字符串、日期列等偏差很大），而是实际读取前若干行测量，再按总行数折算
+    """
+    sample = pd.read_csv(file_path, encoding=encoding, nrows=BASELINE_SAMPLE_ROWS)
+    if sample.empty:
+        return None
+    index_memory = int(sample.index.memory_usage())
+    per_row = (int(sample.memory_usage(deep=True).sum()) - index_memory) / len(sample)
+    return int(per_row * num_rows) + index_memory
+
+
+def _optimize_column(column, parse_dates):
+    """对单列降低内存：整数缩小位宽、浮点无损时转 float32、低基数字符串转 category、可识别的日期转 datetime"""
+    length = len(column)
+    if length == 0 or column.null_count == length:
+        return column.to_pandas()
+
+    if pa.types.is_integer(column.type):
+        bounds = pc.min_max(column)
+        target = _smallest_int_type(bounds['min'].as_py(), bounds['max'].as_py())
+        if column.null_count:
+            # 含缺失值的整数列在 pandas 中只能是浮点，范围允许时使用 float32
+            limit = 2 ** 24
+            if -limit <= bounds['min'].as_py() and bounds['max'].as_py() <= limit:
+                return column.cast(pa.float32()).to_pandas()
+            return column.to_pandas()
+        return column.cast(target).to_pandas()
+
+    if pa.types.is_float64(column.type):
+        narrowed = column.cast(pa.float32(), safe=False)
+        lossless = pc.all(pc.equal(narrowed.cast(pa.float64()), column).fill_null(True)).as_py()
+        return (narrowed if lossless else column).to_pandas()
+
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        if parse_dates:
+            sample = column.slice(0, DATE_SAMPLE_SIZE).drop_null().to_pandas()
+            # 只有形如 2024-01-31、2024/1/31、2024年1月 的值才尝试解析，避免把编号等纯数字误判为日期
+            if not sample.empty and sample.str.contains(DATE_PATTERN, regex=True).all():
+                parsed = pd.to_datetime(sample, errors='coerce', format='mixed')
+                if parsed.notna().mean() >= DATE_MIN_PARSE_RATIO:
+                    series = pd.to_datetime(column.to_pandas(), errors='coerce', format='mixed')
+                    if series.isna().sum() == column.null_count:
+                        return series
+        unique_count = pc.count_distinct(column).as_py()
+        if unique_count <= CATEGORY_MAX_UNIQUE and unique_count <= CATEGORY_MAX_RATIO * length:
+            # 在 Arrow 中直接字典编码，避免先生成大量 Python 字符串对象
+            return column.dictionary_encode().to_pandas()
+
+    return column.to_pandas()
+
+
+def optimize_table(table, parse_dates=True, baseline=None):
+    """把 Arrow 表逐列转换为内存精简的 DataFrame，并在 attrs 中记录默认加载方式的内存占用 baseline"""
+    columns = [_optimize_column(column.combine_chunks(), parse_dates) for column in table.columns]
+    df = pd.concat(columns, axis=1) if columns else pd.DataFrame()
+    df.columns = table.column_names
+    df.attrs['baseline_memory'] = baseline
+    return df
+
+
+def optimize_dataframe(df, parse_dates=True):
+    """对已加载的 DataFrame（如 Excel）应用同样的类型优化"""
+    baseline = int(df.memory_usage(deep=True).sum())
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # 混合类型的列无法转换为 Arrow，只对数值列降位宽
+        optimized = df.copy()
+        for name in optimized.select_dtypes('integer').columns:
+            optimized[name] = pd.to_numeric(optimized[name], downcast='integer')
+        optimized.attrs['baseline_memory'] = baseline
+        return optimized
+    optimized = optimize_table(table, parse_dates)
+    optimized.columns = df.columns
+    optimized.attrs['baseline_memory'] = baseline
+    return optimized
+
+
+def read_csv_lean(file_path, parse_dates=True):
+    """使用 pyarrow 分块流式读取 CSV 并优化列类型，内存占用远小于默认的 pd.read_csv"""
+    read_options = pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE, encoding=detect_encoding(file_path))
+    try:
+        reader = pacsv.open_csv(file_path, read_options=read_options)
+        table = pa.Table.from_batches(list(reader), schema=reader.schema)
+    except pa.ArrowInvalid as e:
+        # 后续分块的类型与首块推断结果不一致时，回退到 pandas 解析
+        print(e)
+        return optimize_dataframe(pd.read_csv(file_path, encoding=read_options.encoding), parse_dates)
+    return optimize_table(table, parse_dates,
+                          baseline=_measure_default_memory(file_path, read_options.encoding, table.num_rows))
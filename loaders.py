@@ -0,0 +1,73 @@
+import pandas as pd
+
+from extraction import detect_encoding, load_pdf_pages
+from retrieval import split_documents
+from storage import load_cached
+
+TABLE_TYPES = ('xlsx', 'xls', 'csv')
+DOCUMENT_TYPES = ('pdf', 'docx', 'txt', 'md')
+
+
+def load_documents(file_path, file_type, fingerprint=None):
+    """加载 PDF/DOCX/TXT/MD 文档，返回逐页的 Document 列表"""
+    # langchain_community 导入较慢，只在第一次加载文档时导入
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+
+    if file_type == 'pdf':
+        if fingerprint is None:
+            loader = PyPDFLoader(file_path)
+            return loader.load()
+        # 按页缓存，页数较多时在进程池中并行提取
+        return load_pdf_pages(file_path, fingerprint)
+    elif file_type == 'docx':
+        loader = Docx2txtLoader(file_path)
+        return loader.load()
+    elif file_type == 'txt' or file_type == 'md':
+        # 【修复】根据文件开头的一小段判断编码，不再先整篇按 UTF-8 解码失败后再按 GBK 重来
+        try:
+            return TextLoader(file_path, encoding=detect_encoding(file_path)).load()
+        except (RuntimeError, UnicodeDecodeError):
+            # 开头一段全是 ASCII 时会被判断为 UTF-8：解码失败后与原来一样改用 GBK，仍失败时按整个文件重新判断编码
+            try:
+                return TextLoader(file_path, encoding='gbk').load()
+            except (RuntimeError, UnicodeDecodeError):
+                return TextLoader(file_path, encoding=detect_encoding(file_path, size=None)).load()
+
+
+def parse_file(file_path, file_type, sheet_name=None, fingerprint=None, lean=False):
+    """解析原始文件并返回DataFrame，lean 为 True 时分块读取并压缩列类型以节省内存"""
+    if lean:
+        from ingestion import optimize_dataframe, read_csv_lean
+    if file_type == 'xlsx' or file_type == 'xls':
+        if lean:
+            return optimize_dataframe(pd.read_excel(file_path, sheet_name=sheet_name))
+        return pd.read_excel(file_path, sheet_name=sheet_name)
+    elif file_type == 'csv':
+        if lean:
+            return read_csv_lean(file_path)
+        return pd.read_csv(file_path)
+    elif file_type in DOCUMENT_TYPES:
+        documents = load_documents(file_path, file_type, fingerprint)
+        return pd.DataFrame({"Content": ["\n".join([doc.page_content for doc in documents])]})
+
+
+def load_dataset(file_path, file_type, sheet_name=None, fingerprint=None, document_mode=False, lean=False):
+    """根据文件类型加载数据并返回DataFrame，同一内容的文件只解析一次并缓存为列式格式
+
+    document_mode 为 True 时，文档被切分为带重叠的片段，每个片段一行；
+    lean 为 True 时，CSV/Excel 以省内存方式加载（整数降位宽、低基数字符串转 category、识别日期列）
+    """
+    if file_type not in TABLE_TYPES + DOCUMENT_TYPES:
+        raise ValueError(f"不支持的文件类型: {file_type}")
+    if document_mode and file_type in DOCUMENT_TYPES:
+        def parse_chunks():
+            return split_documents(load_documents(file_path, file_type, fingerprint))
+
+        if fingerprint is None:
+            return parse_chunks()
+        return load_cached(fingerprint, parse_chunks, sheet_name, 'chunks')
+    lean = lean and file_type in TABLE_TYPES
+    if fingerprint is None:
+        return parse_file(file_path, file_type, sheet_name, lean=lean)
+    return load_cached(fingerprint, lambda: parse_file(file_path, file_type, sheet_name, fingerprint, lean),
+                       *((sheet_name, 'lean') if lean else (sheet_name,)))
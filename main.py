@@ -1,14 +1,29 @@
+import hashlib
+import json
 import os
+import time
 import uuid
-import matplotlib.pyplot as plt
-import openpyxl
 import pandas as pd
 import streamlit as st
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from utils import dataframe_agent
-
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei']
-plt.rcParams['axes.unicode_minus'] = False
+from langchain_core.callbacks import BaseCallbackHandler
+from batch import BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE, parse_questions, run_batch
+from charts import chart_frame, prepare_chart_data, render_chart
+from conversation import Conversation
+from extraction import is_extracted, load_pdf_pages
+from loaders import DOCUMENT_TYPES, load_dataset, parse_file
+from preview import PAGE_SIZES, page_count, page_slice, row_order
+from profiling import get_profile
+from query_engine import open_dataset
+from result_cache import ResultCache, dataframe_fingerprint
+from retrieval import load_index
+from storage import UPLOAD_DIR, dataset_fingerprint, list_sheet_names, prefetch, save_upload
+from tracing import METRICS_PORT, TRACE_FILE, start_metrics_server, start_trace, stage
+from utils import FALLBACK_RESULT, cached_dataframe_agent
+
+# 大文件模式下预览的样本行数
+PREVIEW_ROWS = 1000
+# 调试面板中保留的最近请求数
+TRACE_HISTORY = 10
 
 # 页面配置
 st.set_page_config(
@@ -101,83 +116,293 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
-
 
-def create_chart(input_data, chart_type):
-    """生成统计图表"""
-    df_data = pd.DataFrame(
-        data={
-            "x": input_data["columns"],
-            "y": input_data["data"]
-        }
-    ).set_index("x")
-    
-    if chart_type == "柱状图":
-        plt.style.use('seaborn-v0_8')
-        fig, ax = plt.subplots(figsize=(10, 6), dpi=120)
-        bars = ax.bar(input_data["columns"], input_data["data"], 
-                     color=['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe'],
-                     alpha=0.8, edgecolor='white', linewidth=2)
-        ax.set_title('数据分析结果', fontsize=16, fontweight='bold', pad=20)
-        ax.grid(True, alpha=0.3)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        st.pyplot(fig)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_chart_data(payload_key, chart_type, _input_data):
+    """按图表数据的哈希缓存降采样/合并后的结果"""
+    return prepare_chart_data(_input_data, chart_type)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_chart_image(payload_key, chart_type, _input_data):
+    """按图表数据的哈希缓存渲染好的 PNG，页面重新运行时无需再次绘制"""
+    labels, values = get_chart_data(payload_key, chart_type, _input_data)
+    return render_chart(labels, values, chart_type)
+
+
+def create_chart(input_data, chart_type, interactive=False):
+    """生成统计图表，interactive 为 True 时交给浏览器端绘制"""
+    payload_key = hashlib.sha256(
+        json.dumps(input_data, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    ).hexdigest()
+
+    with stage('render_chart', chart_type=chart_type, interactive=interactive):
+        if chart_type == "折线图" or interactive:
+            labels, values = get_chart_data(payload_key, chart_type, input_data)
+            df_data = chart_frame(labels, values)
+            if chart_type == "柱状图":
+                st.bar_chart(df_data, use_container_width=True)
+            elif chart_type == "折线图":
+                st.line_chart(df_data, use_container_width=True)
+            else:
+                st.vega_lite_chart(df_data.reset_index(), {
+                    "mark": {"type": "arc", "tooltip": True},
+                    "encoding": {
+                        "theta": {"field": "y", "type": "quantitative"},
+                        "color": {"field": "x", "type": "nominal", "title": None}
+                    }
+                }, use_container_width=True)
+            return
+
+        st.image(get_chart_image(payload_key, chart_type, input_data), use_container_width=True)
+
+
+def render_result(result, interactive=False, key=None):
+    """在页面上展示一个分析结果：文字回答、表格以及图表"""
+    if "answer" in result:
+        st.markdown("""
+        <div style="background: linear-gradient(135deg, #e8f5e8 0%, #f0f8f0 100%); 
+                   padding: 1.5rem; border-radius: 15px; margin: 1rem 0;
+                   border-left: 4px solid #4CAF50;">
+            <h4 style="margin-top: 0; color: #2E7D32;">💡 AI分析结果</h4>
+        </div>
+        """, unsafe_allow_html=True)
+        st.markdown(f"**{result['answer']}**")
         
-    elif chart_type == "折线图":
-        st.line_chart(df_data, use_container_width=True)
+    if "table" in result:
+        st.markdown("### 📊 数据表格")
+        result_df = pd.DataFrame(result["table"]["data"], columns=result["table"]["columns"])
+        st.dataframe(result_df, use_container_width=True)
         
-    elif chart_type == "饼图":
-        plt.style.use('seaborn-v0_8')
-        fig, ax = plt.subplots(figsize=(8, 8), dpi=120)
-        colors = ['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe']
-        wedges, texts, autotexts = ax.pie(input_data["data"], labels=input_data["columns"], 
-                                         autopct='%1.1f%%', startangle=90, colors=colors,
-                                         explode=[0.05]*len(input_data["data"]),
-                                         shadow=True)
-        ax.set_title('数据分布图', fontsize=16, fontweight='bold', pad=20)
-        plt.tight_layout()
-        st.pyplot(fig)
+        # 添加下载按钮
+        csv = result_df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="📥 下载表格数据",
+            data=csv,
+            file_name='analysis_result.csv',
+            mime='text/csv',
+            key=key
+        )
+
+    # 图表展示
+    if "bar" in result:
+        st.markdown("### 📊 柱状图分析")
+        create_chart(result["bar"], "柱状图", interactive)
+    elif "line" in result:
+        st.markdown("### 📈 趋势分析")
+        create_chart(result["line"], "折线图", interactive)
+    elif "pie" in result:
+        st.markdown("### 🥧 分布分析")
+        create_chart(result["pie"], "饼图", interactive)
+
+
+def extract_pdf_with_preview(file_path, fingerprint):
+    """逐页提取 PDF，并在页面上实时显示提取进度和最新完成的页面"""
+    if is_extracted(fingerprint):
+        return
+    progress = st.progress(0.0, text="正在提取 PDF 页面...")
+    preview = st.empty()
+    last_refresh = [0.0]
+
+    def on_page(page, text, done, total):
+        now = time.monotonic()
+        if now - last_refresh[0] < 0.2 and done < total:
+            return
+        last_refresh[0] = now
+        progress.progress(done / total, text=f"正在提取 PDF 页面：{done}/{total}")
+        preview.markdown(f"**第 {page + 1} 页**\n\n{text[:500]}")
+
+    load_pdf_pages(file_path, fingerprint, on_page=on_page)
+    progress.empty()
+    preview.empty()
+
+
+class AgentProgressHandler(BaseCallbackHandler):
+    """将 Agent 每一步的思考过程、工具调用和执行结果实时展示在页面上"""
+
+    def __init__(self, container, refresh_interval=0.2):
+        self.container = container
+        self.refresh_interval = refresh_interval
+        self.step = 0
+        self.text = ""
+        self.placeholder = None
+        self.last_refresh = 0.0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.step += 1
+        self.text = ""
+        self.container.markdown(f"**第 {self.step} 步**")
+        self.placeholder = self.container.empty()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        # 按时间间隔节流刷新，避免每个 token 都重绘页面
+        now = time.monotonic()
+        if self.placeholder is not None and now - self.last_refresh >= self.refresh_interval:
+            self.placeholder.markdown(self.text)
+            self.last_refresh = now
+
+    def on_llm_end(self, response, **kwargs):
+        if self.placeholder is not None and self.text:
+            self.placeholder.markdown(self.text)
+
+    def on_agent_action(self, action, **kwargs):
+        self.container.markdown(f"🔧 调用工具 `{action.tool}`")
+        self.container.code(str(action.tool_input), language="python")
+
+    def on_tool_end(self, output, **kwargs):
+        self.container.text(str(output)[:2000])
+
+    def on_tool_error(self, error, **kwargs):
+        self.container.warning(f"工具执行出错: {error}")
 
 
 # 使用 st.cache_data 缓存文件加载函数
 @st.cache_data(show_spinner="正在加载数据...")
-def load_data(file_path, file_type, sheet_name=None):
-    """根据文件类型加载数据并返回DataFrame"""
+def load_data(file_path, file_type, sheet_name=None, fingerprint=None, document_mode=False, lean=False):
+    """根据文件类型加载数据并返回DataFrame，加载出错时在页面上提示并返回空表"""
     try:
-        if file_type == 'xlsx' or file_type == 'xls':
-            return pd.read_excel(file_path, sheet_name=sheet_name)
-        elif file_type == 'csv':
-            return pd.read_csv(file_path)
-        elif file_type == 'pdf':
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
-            return pd.DataFrame({"Content": ["\n".join([doc.page_content for doc in documents])]})
-        elif file_type == 'docx':
-            loader = Docx2txtLoader(file_path)
-            documents = loader.load()
-            return pd.DataFrame({"Content": ["\n".join([doc.page_content for doc in documents])]})
-        elif file_type == 'txt' or file_type == 'md':
-            # 【修复】智能尝试多种编码加载文本文件
-            try:
-                # 优先尝试 UTF-8，因为它是最标准的编码
-                loader = TextLoader(file_path, encoding='utf-8')
-                documents = loader.load()
-            except (UnicodeDecodeError, RuntimeError):
-                # 如果 UTF-8 失败，回退尝试 GBK 编码，它在中国很常用
-                loader = TextLoader(file_path, encoding='gbk')
-                documents = loader.load()
-            return pd.DataFrame({"Content": ["\n".join([doc.page_content for doc in documents])]})
-        else:
-            st.error(f"不支持的文件类型: {file_type}")
-            return pd.DataFrame()
+        return load_dataset(file_path, file_type, sheet_name, fingerprint, document_mode, lean)
     except Exception as e:
         st.error(f"加载文件时发生错误: {e}")
         return pd.DataFrame()
 
 
+@st.cache_data(show_spinner=False)
+def get_sheet_names(file_path, fingerprint):
+    """读取Excel工作表名称，按文件指纹缓存，避免每次重新运行都打开整个工作簿"""
+    return list_sheet_names(file_path)
+
+
+def prefetch_sheets(file_path, file_type, fingerprint, sheet_names, lean=False):
+    """在后台解析其余工作表，切换工作表时直接命中列式缓存"""
+    prefetch(fingerprint, lambda sheet, *_: parse_file(file_path, file_type, sheet, lean=lean),
+             [(sheet, 'lean') if lean else (sheet,) for sheet in sheet_names])
+
+
+@st.cache_resource(show_spinner="正在准备大文件查询引擎...")
+def get_duckdb_dataset(file_path, file_type, fingerprint, sheet_name=None):
+    """大文件模式下的 DuckDB 数据集句柄，所有会话共享"""
+    return open_dataset(file_path, file_type, fingerprint,
+                        lambda: parse_file(file_path, file_type, sheet_name), sheet_name)
+
+
+@st.cache_resource(show_spinner="正在构建文档检索索引...")
+def get_document_index(fingerprint, _chunks):
+    """文档检索模式下的 FAISS 索引，按文档指纹在所有会话间共享"""
+    return load_index(fingerprint, _chunks)
+
+
+def load_into_session(file_path, file_type, fingerprint, sheet_name=None):
+    """加载数据到当前会话；大文件模式下只保存 DuckDB 句柄和用于预览的样本"""
+    st.session_state['dataset_fingerprint'] = dataset_fingerprint(fingerprint, sheet_name)
+    st.session_state.pop('dataset', None)
+    st.session_state.pop('document_index', None)
+    st.session_state.pop('conversation', None)
+    if file_type == 'pdf':
+        try:
+            extract_pdf_with_preview(file_path, fingerprint)
+        except Exception as e:
+            st.error(f"加载文件时发生错误: {e}")
+            st.session_state['df'] = pd.DataFrame()
+            return
+    if st.session_state.get('load_mode') == 'document' and file_type in DOCUMENT_TYPES:
+        st.session_state['dataset_fingerprint'] = dataset_fingerprint(fingerprint, sheet_name, 'chunks')
+        st.session_state['df'] = load_data(file_path, file_type, sheet_name=sheet_name, fingerprint=fingerprint,
+                                           document_mode=True)
+        if not st.session_state['df'].empty:
+            st.session_state['document_index'] = get_document_index(fingerprint, st.session_state['df'])
+        return
+    if st.session_state.get('load_mode') == 'duckdb':
+        try:
+            dataset = get_duckdb_dataset(file_path, file_type, fingerprint, sheet_name)
+            st.session_state['dataset'] = dataset
+            st.session_state['df'] = dataset.sample(PREVIEW_ROWS)
+            return
+        except Exception as e:
+            st.error(f"大文件模式加载失败，已切换为常规模式: {e}")
+    lean = st.session_state.get('load_mode') == 'lean'
+    if lean:
+        st.session_state['dataset_fingerprint'] = dataset_fingerprint(fingerprint, sheet_name, 'lean')
+    st.session_state['df'] = load_data(file_path, file_type, sheet_name=sheet_name, fingerprint=fingerprint,
+                                       lean=lean)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_row_order(fingerprint, sort_by, ascending, filter_column, filter_text, _df):
+    """筛选排序后的行顺序，按 (数据集, 排序, 筛选) 缓存，翻页时无需重新排序"""
+    return row_order(_df, sort_by, ascending, filter_column, filter_text)
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_preview_page(fingerprint, page, page_size, sort_by, ascending, filter_column, filter_text, _df, _dataset=None):
+    """返回预览的某一页及满足筛选条件的总行数，按 (数据集, 页码, 排序, 筛选) 缓存，回翻时直接命中"""
+    if _dataset is not None:
+        return _dataset.page(page, page_size, sort_by, ascending, filter_column, filter_text)
+    positions = get_row_order(fingerprint, sort_by, ascending, filter_column, filter_text, _df)
+    return page_slice(_df, positions, page, page_size), len(positions)
+
+
+@st.fragment
+def render_data_preview(df, dataset, fingerprint):
+    """分页数据预览，以片段方式运行，翻页、排序和筛选只重新运行预览区域"""
+    columns = list(df.columns)
+    col1, col2, col3, col4, col5 = st.columns([2, 1, 2, 2, 1])
+    with col1:
+        sort_by = st.selectbox("排序列", [None] + columns, format_func=lambda c: "不排序" if c is None else str(c),
+                               key="preview_sort_by")
+    with col2:
+        ascending = st.toggle("升序", value=True, key="preview_ascending")
+    with col3:
+        filter_column = st.selectbox("筛选列", [None] + columns,
+                                     format_func=lambda c: "不筛选" if c is None else str(c), key="preview_filter_column")
+    with col4:
+        filter_text = st.text_input("包含文本", key="preview_filter_text", disabled=filter_column is None)
+    with col5:
+        page_size = st.selectbox("每页行数", PAGE_SIZES, key="preview_page_size")
+
+    if fingerprint is None:
+        fingerprint = dataframe_fingerprint(df)
+    # DuckDB 模式下 df 只是样本，分页结果来自全量数据，需与 pandas 模式分开缓存
+    fingerprint = (fingerprint, dataset is not None)
+    filter_text = filter_text.strip() if filter_column is not None else ''
+    _, total = get_preview_page(fingerprint, 0, page_size, sort_by, ascending, filter_column, filter_text,
+                                df, dataset)
+    pages = page_count(total, page_size)
+    page = st.number_input(f"页码（共 {pages} 页，{total} 行）", min_value=1, max_value=pages, value=1, step=1,
+                           key=f"preview_page_{pages}")
+    page_df, _ = get_preview_page(fingerprint, page - 1, page_size, sort_by, ascending, filter_column, filter_text,
+                                  df, dataset)
+    st.dataframe(page_df, use_container_width=True, height=400)
+
+
+def remember_trace(trace):
+    """保存最近几次请求的埋点摘要，供侧边栏调试面板展示"""
+    traces = st.session_state.setdefault('traces', [])
+    traces.append(trace.summary())
+    del traces[:-TRACE_HISTORY]
+
+
+@st.cache_resource
+def get_result_cache():
+    """所有会话共享的分析结果缓存，数据持久化在本地 SQLite 中"""
+    return ResultCache()
+
+
+def get_analysis_result(df, data_fingerprint, query_text, callbacks=None, result_cache=None, conversation=None):
+    """先查询持久化结果缓存，未命中时再调用 AI 分析并写入缓存；在后台线程中调用时需传入 result_cache"""
+    return cached_dataframe_agent(result_cache or get_result_cache(), df, query_text, data_fingerprint, callbacks,
+                                  conversation)
+
+
+def get_conversation(data_fingerprint):
+    """当前会话针对该数据集的连续对话，换了数据集时重新开始"""
+    conversation = st.session_state.get('conversation')
+    if conversation is None or conversation.data_fingerprint != data_fingerprint:
+        conversation = st.session_state['conversation'] = Conversation(data_fingerprint)
+    return conversation
+
+
 
 
 # 主标题区域
@@ -229,9 +454,9 @@ if 'session_id' not in st.session_state:
     st.session_state['is_new_file'] = True
     st.session_state['current_file_name'] = None
 
-# 如果 'uploads' 目录不存在则创建它
-if not os.path.exists('uploads'):
-    os.makedirs('uploads')
+# 如果上传目录不存在则创建它
+if not os.path.exists(UPLOAD_DIR):
+    os.makedirs(UPLOAD_DIR)
 
 with st.sidebar:
     st.markdown("""
@@ -268,6 +493,18 @@ with st.sidebar:
         accept_multiple_files=False
     )
     
+    load_mode = 'pandas'
+    if option in ("Excel", "CSV"):
+        load_modes = {"常规": 'pandas', "🪶 省内存": 'lean', "🦆 大文件（DuckDB）": 'duckdb'}
+        load_mode = load_modes[st.radio(
+            "⚙️ 加载方式",
+            list(load_modes),
+            help="省内存：分块读取并压缩列类型（整数降位宽、低基数文本转分类、识别日期列）；"
+                 "大文件：使用 DuckDB 直接查询磁盘上的数据，不把整个文件载入内存"
+        )]
+    elif st.toggle("📚 文档检索模式", value=True, help="将文档切分为片段并建立向量索引，每个问题只把最相关的片段交给AI"):
+        load_mode = 'document'
+
     if data:
         st.success(f"✅ 文件已上传: {data.name}")
         file_size = len(data.getvalue()) / 1024  # KB
@@ -282,48 +519,57 @@ with st.sidebar:
 
 # 清除缓存的 DataFrame 如果上传了新文件
 if data:
-    if 'current_file_name' not in st.session_state or st.session_state['current_file_name'] != data.name:
+    if 'current_file_name' not in st.session_state or st.session_state['current_file_name'] != data.name \
+            or st.session_state.get('load_mode') != load_mode:
         st.session_state['is_new_file'] = True
         st.session_state['current_file_name'] = data.name
-
-        suffix = data.name[data.name.rfind('.'):].lower().replace('.', '')
-
-        temp_file_path = os.path.join('uploads', f'{st.session_state["session_id"]}_{data.name}')
-
-        # 【修复】统一使用二进制写入模式('wb')保存所有上传文件，以保留其原始字节，避免编码问题
-        with open(temp_file_path, 'wb') as temp_file:
-            temp_file.write(data.read())
-
-        sheet_name_to_load = None
-        if suffix in ('xlsx', 'xls'):
-            try:
-                wb = openpyxl.load_workbook(temp_file_path)
-                sheet_names = wb.sheetnames
-                if sheet_names:
-                    if 'selected_excel_sheet' in st.session_state and st.session_state[
-                        'selected_excel_sheet'] in sheet_names:
-                        default_sheet_index = sheet_names.index(st.session_state['selected_excel_sheet'])
+        st.session_state['load_mode'] = load_mode
+
+        with start_trace('upload', file=data.name, mode=load_mode) as upload_trace:
+            suffix = data.name[data.name.rfind('.'):].lower().replace('.', '')
+
+            # 【修复】统一以原始字节保存所有上传文件，避免编码问题
+            # 按内容指纹寻址存储，相同文件在不同会话之间只保存和解析一次
+            with stage('save_upload'):
+                file_fingerprint, temp_file_path = save_upload(data.getvalue(), data.name)
+            st.session_state['file_fingerprint'] = file_fingerprint
+            st.session_state['temp_file_path'] = temp_file_path
+
+            sheet_name_to_load = None
+            sheet_names = []
+            if suffix in ('xlsx', 'xls'):
+                try:
+                    sheet_names = get_sheet_names(temp_file_path, file_fingerprint)
+                    if sheet_names:
+                        if 'selected_excel_sheet' in st.session_state and st.session_state[
+                            'selected_excel_sheet'] in sheet_names:
+                            default_sheet_index = sheet_names.index(st.session_state['selected_excel_sheet'])
+                        else:
+                            default_sheet_index = 0
+
+                        selected_sheet = st.radio(label="请选择要加载的工作表：", options=sheet_names,
+                                                  index=default_sheet_index, key="excel_sheet_selector")
+                        st.session_state['selected_excel_sheet'] = selected_sheet
+                        sheet_name_to_load = selected_sheet
                     else:
-                        default_sheet_index = 0
-
-                    selected_sheet = st.radio(label="请选择要加载的工作表：", options=sheet_names,
-                                              index=default_sheet_index, key="excel_sheet_selector")
-                    st.session_state['selected_excel_sheet'] = selected_sheet
-                    sheet_name_to_load = selected_sheet
-                else:
-                    st.warning("Excel 文件中没有检测到工作表。")
-            except Exception as e:
-                st.error(f"读取Excel工作表时出错: {e}")
-
-        st.session_state["df"] = load_data(temp_file_path, suffix, sheet_name=sheet_name_to_load)
+                        st.warning("Excel 文件中没有检测到工作表。")
+                except Exception as e:
+                    st.error(f"读取Excel工作表时出错: {e}")
+
+            with stage('load_data'):
+                load_into_session(temp_file_path, suffix, file_fingerprint, sheet_name_to_load)
+            if len(sheet_names) > 1:
+                prefetch_sheets(temp_file_path, suffix, file_fingerprint,
+                                [sheet for sheet in sheet_names if sheet != sheet_name_to_load],
+                                lean=load_mode == 'lean')
+        remember_trace(upload_trace)
 
     elif 'current_file_name' in st.session_state and st.session_state['current_file_name'] == data.name:
         suffix = data.name[data.name.rfind('.'):].lower().replace('.', '')
         if suffix in ('xlsx', 'xls'):
-            temp_file_path = os.path.join('uploads', f'{st.session_state["session_id"]}_{data.name}')
+            temp_file_path = st.session_state['temp_file_path']
             try:
-                wb = openpyxl.load_workbook(temp_file_path)
-                sheet_names = wb.sheetnames
+                sheet_names = get_sheet_names(temp_file_path, st.session_state['file_fingerprint'])
                 if sheet_names:
                     if 'selected_excel_sheet' in st.session_state and st.session_state[
                         'selected_excel_sheet'] in sheet_names:
@@ -334,7 +580,10 @@ if data:
                                               index=default_sheet_index, key="excel_sheet_selector_re_render")
                     if selected_sheet != st.session_state.get('selected_excel_sheet'):
                         st.session_state['selected_excel_sheet'] = selected_sheet
-                        st.session_state["df"] = load_data(temp_file_path, suffix, sheet_name=selected_sheet)
+                        with start_trace('upload', file=data.name, sheet=selected_sheet) as upload_trace:
+                            load_into_session(temp_file_path, suffix, st.session_state['file_fingerprint'],
+                                              selected_sheet)
+                        remember_trace(upload_trace)
                 else:
                     st.warning("Excel 文件中没有检测到工作表。")
             except Exception as e:
@@ -344,41 +593,69 @@ if data:
 if "df" in st.session_state and not st.session_state['df'].empty:
     st.markdown("## 📋 数据预览")
     
-    # 数据统计信息
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        st.metric("📊 总行数", len(st.session_state["df"]), help="数据集的总行数")
-    with col2:
-        st.metric("📈 总列数", len(st.session_state["df"].columns), help="数据集的总列数")
-    with col3:
-        memory_usage = st.session_state["df"].memory_usage(deep=True).sum() / 1024
-        st.metric("💾 内存占用", f"{memory_usage:.1f} KB", help="数据在内存中的占用大小")
-    with col4:
-        null_count = st.session_state["df"].isnull().sum().sum()
-        st.metric("❓ 缺失值", null_count, help="数据集中的缺失值总数")
-    
+    # 数据统计信息：按数据集指纹缓存的概况在后台线程中计算，页面重新运行时不再重复扫描整个 DataFrame
+    # 【修复】DuckDB 模式下 df 只是样本，概况需与 pandas 模式加载的全量数据分开缓存
+    profile_fingerprint = st.session_state.get('dataset_fingerprint')
+    if "dataset" in st.session_state and profile_fingerprint is not None:
+        profile_fingerprint = (profile_fingerprint, 'sample')
+    profile = get_profile(st.session_state["df"], profile_fingerprint)
+    profile_was_ready = profile.ready
+
+    # 统计未完成时以片段方式定时刷新指标卡片，完成后整页重新运行一次以更新数据类型表
+    @st.fragment(run_every=None if profile_was_ready else 0.5)
+    def profile_metrics():
+        if profile.ready and not profile_was_ready:
+            st.rerun()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            if "dataset" in st.session_state:
+                st.metric("📊 总行数", st.session_state["dataset"].num_rows, help="数据集的总行数")
+            else:
+                st.metric("📊 总行数", profile.num_rows, help="数据集的总行数")
+        with col2:
+            st.metric("📈 总列数", profile.num_columns, help="数据集的总列数")
+        with col3:
+            baseline_memory = st.session_state["df"].attrs.get('baseline_memory')
+            if profile.memory_bytes is None:
+                st.metric("💾 内存占用", "计算中...", help="数据在内存中的占用大小")
+            elif baseline_memory:
+                # 省内存模式下同时展示与默认加载方式相比的变化
+                memory_usage = profile.memory_bytes / 1024
+                st.metric("💾 内存占用", f"{memory_usage:.1f} KB",
+                          delta=f"{memory_usage - baseline_memory / 1024:.1f} KB", delta_color="inverse",
+                          help=f"数据在内存中的占用大小（默认加载约 {baseline_memory / 1024:.1f} KB）")
+            else:
+                st.metric("💾 内存占用", f"{profile.memory_bytes / 1024:.1f} KB", help="数据在内存中的占用大小")
+        with col4:
+            null_count = profile.null_count
+            st.metric("❓ 缺失值", "计算中..." if null_count is None else null_count, help="数据集中的缺失值总数")
+
+    profile_metrics()
+
+    if "dataset" in st.session_state:
+        st.caption(f"🦆 大文件模式：数据保留在磁盘上由 DuckDB 按需查询，"
+                   f"内存占用、缺失值和预览仅基于前 {PREVIEW_ROWS} 行样本")
+
     with st.expander("🔍 查看原始数据", expanded=False):
-        st.dataframe(
-            st.session_state["df"], 
-            use_container_width=True,
-            height=400
-        )
+        # 分页预览：筛选、排序和分页在服务端完成，每次只把当前页发送到浏览器
+        render_data_preview(st.session_state["df"], st.session_state.get("dataset"),
+                            st.session_state.get('dataset_fingerprint'))
         
         # 数据类型信息
         if st.checkbox("显示数据类型信息"):
             st.subheader("📝 数据类型")
-            dtype_df = pd.DataFrame({
-                '列名': st.session_state["df"].columns,
-                '数据类型': st.session_state["df"].dtypes.values,
-                '非空值数量': st.session_state["df"].count().values
-            })
-            st.dataframe(dtype_df, use_container_width=True)
+            if profile.null_counts is None:
+                st.info("⏳ 正在统计各列信息，请稍候...")
+            else:
+                st.dataframe(profile.dtype_table(), use_container_width=True)
             
 elif "df" in st.session_state and "current_file_name" in st.session_state and st.session_state[
     'current_file_name'] is not None and st.session_state['df'].empty:
     st.warning("⚠️ 上传的文件已处理，但生成的 DataFrame 为空。")
 elif data is None and "df" in st.session_state:
     st.session_state.pop('df', None)
+    st.session_state.pop('dataset', None)
+    st.session_state.pop('document_index', None)
 
 # 查询输入区域
 st.markdown("## 💬 智能问答")
@@ -396,14 +673,42 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+batch_mode = st.toggle("📋 批量提问", value=False, help="一次输入多个问题（每行一个），并发分析并逐个显示结果")
+
 query = st.text_area(
-    "💭 请输入你关于数据的问题或可视化需求：",
+    "💭 请输入你关于数据的问题或可视化需求：" if not batch_mode else "💭 请输入多个问题，每行一个：",
     disabled="df" not in st.session_state,
-    placeholder='例如：分析销售数据的趋势，或生成销售额的柱状图...',
-    height=100,
+    placeholder='例如：分析销售数据的趋势，或生成销售额的柱状图...' if not batch_mode
+    else '例如：\n各地区销售额总和\n销售额最高的10个产品\n按月销售额趋势',
+    height=100 if not batch_mode else 240,
     help="输入您想要了解的数据问题，AI将为您提供详细分析"
 )
 
+if batch_mode:
+    col1, col2 = st.columns(2)
+    with col1:
+        batch_concurrency = st.slider("并发数", min_value=1, max_value=16, value=BATCH_CONCURRENCY,
+                                      help="同时进行分析的问题数量")
+    with col2:
+        batch_rate = st.number_input("每分钟最多请求数（0 为不限制）", min_value=0, value=BATCH_REQUESTS_PER_MINUTE,
+                                     step=10, help="避免超过模型服务的调用频率限制")
+else:
+    show_progress = st.checkbox("🔎 实时显示分析过程", value=True, help="逐步展示AI的思考过程和工具调用")
+    conversation_mode = st.toggle("💬 连续对话", value=False,
+                                  help="保留之前的提问、分析过程和中间结果，可以直接追问，如“再按地区拆分一下”")
+    conversation = st.session_state.get('conversation')
+    if conversation_mode and conversation is not None and conversation.turns:
+        with st.expander(f"🗂️ 对话记录（最近 {len(conversation.turns)} 轮）"):
+            for turn in conversation.turns:
+                st.markdown(f"**{turn['number']}. {turn['question']}**")
+                st.caption(turn['result'])
+            if conversation.frames:
+                st.caption("保留的中间结果：" + "、".join(f"`{name}`" for name in conversation.frames))
+            if st.button("🧹 清空对话", help="清空对话记录和中间结果，下一个问题重新开始"):
+                conversation.clear()
+                st.rerun()
+interactive_charts = st.checkbox("🖱️ 交互式图表", value=False, help="在浏览器端绘制图表，可缩放并悬停查看数值")
+
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     button = st.button(
@@ -413,64 +718,99 @@ with col2:
         disabled=not query or "df" not in st.session_state
     )
 
+
 if button and not data:
     st.error("❌ 请先上传数据文件")
     st.stop()
 
 if button and query and "df" in st.session_state and not st.session_state["df"].empty:
-    # 显示分析进度
-    with st.spinner("🤖 AI正在分析您的数据，请稍候..."):
-        @st.cache_data(show_spinner=False, ttl=3600)
-        def get_analysis_result(df_hash, query_text):
-            return dataframe_agent(st.session_state["df"], query_text)
-
-        df_hash_key = hash((st.session_state["df"].shape, tuple(st.session_state["df"].columns)))
-        result = get_analysis_result(df_hash_key, query)
-    
-    # 结果展示区域
-    st.markdown("## 🎯 分析结果")
-    
-    if "answer" in result:
-        st.markdown("""
-        <div style="background: linear-gradient(135deg, #e8f5e8 0%, #f0f8f0 100%); 
-                   padding: 1.5rem; border-radius: 15px; margin: 1rem 0;
-                   border-left: 4px solid #4CAF50;">
-            <h4 style="margin-top: 0; color: #2E7D32;">💡 AI分析结果</h4>
-        </div>
-        """, unsafe_allow_html=True)
-        st.markdown(f"**{result['answer']}**")
-        
-    if "table" in result:
-        st.markdown("### 📊 数据表格")
-        result_df = pd.DataFrame(result["table"]["data"], columns=result["table"]["columns"])
-        st.dataframe(result_df, use_container_width=True)
-        
-        # 添加下载按钮
-        csv = result_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 下载表格数据",
-            data=csv,
-            file_name='analysis_result.csv',
-            mime='text/csv'
-        )
+    data_fingerprint = st.session_state.get('dataset_fingerprint') or dataframe_fingerprint(
+        st.session_state["df"])
+    # 大文件模式下交给 DuckDB 数据集，文档检索模式下交给向量索引，否则直接分析内存中的 DataFrame
+    analysis_data = st.session_state.get("dataset", st.session_state.get("document_index", st.session_state["df"]))
+
+    if batch_mode:
+        questions = parse_questions(query)
+        result_cache = get_result_cache()
+
+        batch_traces = []
+
+        def analyze(question):
+            with start_trace('analysis', query=question, batch=True) as trace:
+                try:
+                    result = get_analysis_result(analysis_data, data_fingerprint, question, result_cache=result_cache)
+                except Exception as e:
+                    print(e)
+                    result = dict(FALLBACK_RESULT)
+            batch_traces.append(trace)
+            return result
+
+        st.markdown("## 🎯 分析结果")
+        # 按问题顺序预留位置，哪个问题先完成就先填充哪个
+        placeholders = []
+        for i, question in enumerate(questions, start=1):
+            slot = st.container(border=True)
+            slot.markdown(f"#### ❓ {i}. {question}")
+            placeholder = slot.empty()
+            placeholder.info("⏳ 等待分析...")
+            placeholders.append(placeholder)
+        progress = st.progress(0.0, text=f"已完成 0/{len(questions)}")
+        started = time.monotonic()
+        for done, (i, question, result) in enumerate(run_batch(analyze, questions, batch_concurrency, batch_rate),
+                                                     start=1):
+            with placeholders[i].container():
+                render_result(result, interactive_charts, key=f"batch_download_{i}")
+            progress.progress(done / len(questions), text=f"已完成 {done}/{len(questions)}")
+        progress.empty()
+        for trace in batch_traces:
+            remember_trace(trace)
+        st.success(f"✅ {len(questions)} 个问题分析完成，用时 {time.monotonic() - started:.1f} 秒")
+    else:
+        conversation = get_conversation(data_fingerprint) if conversation_mode else None
+        with start_trace('analysis', query=query, conversation=conversation_mode) as analysis_trace:
+            # 显示分析进度
+            if show_progress:
+                # 点击停止按钮会触发页面重新运行，正在进行的分析在下一步回调时即被中断，不再继续消耗 token
+                st.button("⏹️ 停止分析", help="中断当前分析")
+                with st.status("🤖 AI正在分析您的数据，请稍候...", expanded=True) as status:
+                    progress_handler = AgentProgressHandler(status)
+                    result = get_analysis_result(analysis_data, data_fingerprint, query, callbacks=[progress_handler],
+                                                 conversation=conversation)
+                    status.update(label=f"✅ 分析完成（共 {progress_handler.step} 步）" if progress_handler.step
+                                  else "✅ 已直接计算或从缓存中获取分析结果", state="complete", expanded=False)
+            else:
+                with st.spinner("🤖 AI正在分析您的数据，请稍候..."):
+                    result = get_analysis_result(analysis_data, data_fingerprint, query, conversation=conversation)
+
+            # 结果展示区域
+            st.markdown("## 🎯 分析结果")
+            render_result(result, interactive_charts)
+
+            # 成功提示
+            st.success("✅ 分析完成！可以直接继续追问。" if conversation is not None
+                       else "✅ 分析完成！如需进一步分析，请输入新的问题。")
+        remember_trace(analysis_trace)
 
-    # 图表展示
-    if "bar" in result:
-        st.markdown("### 📊 柱状图分析")
-        create_chart(result["bar"], "柱状图")
-    elif "line" in result:
-        st.markdown("### 📈 趋势分析")
-        create_chart(result["line"], "折线图")
-    elif "pie" in result:
-        st.markdown("### 🥧 分布分析")
-        create_chart(result["pie"], "饼图")
-        
-    # 成功提示
-    st.success("✅ 分析完成！如需进一步分析，请输入新的问题。")
-    
 elif button:
     st.warning("⚠️ 请上传数据文件并输入问题。")
 
+# 侧边栏调试面板：最近几次请求的各阶段耗时、token 数、Agent 迭代次数和缓存命中情况
+start_metrics_server()
+with st.sidebar:
+    if st.toggle("🐞 调试面板", value=False, help="显示最近请求的阶段耗时和计数"):
+        traces = st.session_state.get('traces', [])
+        if not traces:
+            st.caption("暂无记录")
+        for trace in reversed(traces):
+            with st.expander(f"{trace['name']} · {trace['total_seconds']:.2f} 秒"):
+                st.dataframe(pd.DataFrame(list(trace['stages'].items()), columns=["阶段", "耗时（秒）"]),
+                             hide_index=True, use_container_width=True)
+                st.json(trace['counters'])
+        if TRACE_FILE:
+            st.caption(f"追踪文件：{TRACE_FILE}")
+        if METRICS_PORT:
+            st.caption(f"指标：http://127.0.0.1:{METRICS_PORT}/metrics")
+
 # 页脚
 st.markdown("---")
 st.markdown("""
@@ -0,0 +1,31 @@
+import numpy as np
+
+PAGE_SIZES = (50, 100, 500)
+
+
+def row_order(df, sort_by=None, ascending=True, filter_column=None, filter_text=''):
+    """返回筛选并排序后的行位置数组，分页时只按位置切片，不复制整个 DataFrame"""
+    positions = np.arange(len(df))
+    if filter_text and filter_column is not None:
+        column = df[filter_column]
+        mask = column.astype(str).str.contains(filter_text, case=False, regex=False, na=False).to_numpy()
+        positions = positions[mask]
+
+    if sort_by is not None and len(positions):
+        values = df[sort_by].iloc[positions].reset_index(drop=True)
+        try:
+            ordered = values.sort_values(ascending=ascending, kind='stable', na_position='last')
+        except TypeError:
+            # 混合类型的列无法直接比较，按文本排序
+            ordered = values.astype(str).sort_values(ascending=ascending, kind='stable')
+        positions = positions[ordered.index.to_numpy()]
+    return positions
+
+
+def page_slice(df, positions, page, page_size):
+    """取出第 page 页（从 0 开始）对应的行"""
+    return df.iloc[positions[page * page_size:(page + 1) * page_size]]
+
+
+def page_count(total, page_size):
+    return max(1, -(-total // page_size))
@@ -0,0 +1,172 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# 数据集摘要的 token 预算，替代直接把 df.head() 原始行放进提示词
+DIGEST_TOKEN_BUDGET = int(os.environ.get("DIGEST_TOKEN_BUDGET", 1500))
+PROFILE_CACHE_SIZE = 32
+# 单个样本值的最大字符数，防止 PDF/DOCX 的整篇文本单元格撑满上下文
+MAX_VALUE_CHARS = 60
+
+_profile_cache = OrderedDict()
+_profile_cache_lock = threading.Lock()
+# 数据集概况在后台线程中计算，页面重新运行时不会被阻塞
+_profile_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='profile')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：ASCII 约 4 个字符一个 token，中文等非 ASCII 字符约一个字符一个 token"""
+    ascii_count = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_count // 4 + (len(text) - ascii_count)
+
+
+def _shorten(value, limit=MAX_VALUE_CHARS):
+    text = ' '.join(str(value).split())
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+def _describe_column(series, max_samples=5):
+    """统计单列的类型、缺失率、基数、数值范围，返回 (描述片段, 样本值)"""
+    total = len(series)
+    null_rate = series.isna().mean() if total else 0.0
+    parts = [f'{series.dtype}', f'缺失率 {null_rate:.1%}']
+    try:
+        parts.append(f'唯一值 {series.nunique(dropna=True)}')
+    except TypeError:
+        pass
+
+    samples = []
+    non_null = series.dropna()
+    if non_null.empty:
+        return parts, samples
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        parts.append(f'范围 [{non_null.min():.6g}, {non_null.max():.6g}]')
+        parts.append(f'均值 {non_null.mean():.6g}')
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        parts.append(f'范围 [{non_null.min()}, {non_null.max()}]')
+    else:
+        lengths = non_null.astype(str).str.len()
+        if lengths.max() > MAX_VALUE_CHARS * 4:
+            # 长文本列（如 PDF/DOCX 全文）只给出长度信息和开头片段
+            parts.append(f'文本长度 {int(lengths.min())}~{int(lengths.max())} 字符')
+        try:
+            samples = list(non_null.value_counts().index[:max_samples])
+        except TypeError:
+            samples = list(non_null.iloc[:max_samples])
+    return parts, samples
+
+
+class DatasetProfile:
+    """数据集概况：行列数和类型立即可用，缺失值、内存占用和逐列统计在后台线程中逐步补全"""
+
+    def __init__(self, df):
+        self.num_rows = len(df)
+        self.num_columns = len(df.columns)
+        self.columns = list(df.columns)
+        self.dtypes = list(df.dtypes)
+        self.null_counts = None
+        self.memory_bytes = None
+        self.column_stats = None
+        self.error = None
+        self._done = threading.Event()
+        self._digests = {}
+
+    def compute(self, df):
+        """按代价从低到高依次计算各项统计，每完成一项即可被页面读取"""
+        try:
+            self.null_counts = df.isna().sum().to_numpy()
+            self.memory_bytes = int(df.memory_usage(deep=True).sum())
+            self.column_stats = [_describe_column(df.iloc[:, i]) for i in range(self.num_columns)]
+        except Exception as e:
+            print(e)
+            self.error = e
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def null_count(self):
+        return None if self.null_counts is None else int(self.null_counts.sum())
+
+    def dtype_table(self):
+        """列名、数据类型和非空值数量"""
+        non_null = None if self.null_counts is None else self.num_rows - self.null_counts
+        return pd.DataFrame({
+            '列名': self.columns,
+            '数据类型': self.dtypes,
+            '非空值数量': non_null
+        })
+
+    def digest(self, token_budget=DIGEST_TOKEN_BUDGET):
+        """基于逐列统计生成摘要，同一预算只生成一次"""
+        self.wait()
+        if token_budget not in self._digests:
+            self._digests[token_budget] = _format_digest(self.num_rows, self.columns, self.column_stats or [],
+                                                         token_budget)
+        return self._digests[token_budget]
+
+
+def _format_digest(num_rows, columns, column_stats, token_budget):
+    header = f'共 {num_rows} 行，{len(columns)} 列。各列信息：'
+    described = [(f'- {_shorten(column, 40)!r}: ', stats) for column, stats in zip(columns, column_stats)]
+    # 优先减少样本值个数，仍然超出预算时再省略后面的列
+    for n_samples in (5, 3, 1, 0):
+        lines = [header]
+        used = estimate_tokens(header)
+        for i, (name, (parts, samples)) in enumerate(described):
+            if n_samples and samples:
+                parts = parts + ['样本 ' + ', '.join(repr(_shorten(v)) for v in samples[:n_samples])]
+            line = name + '，'.join(parts)
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                if n_samples:
+                    break
+                lines.append(f'- …… 其余 {len(described) - i} 列已省略')
+                return '\n'.join(lines)
+            lines.append(line)
+            used += cost
+        else:
+            return '\n'.join(lines)
+    return '\n'.join(lines)
+
+
+def build_digest(df, token_budget=DIGEST_TOKEN_BUDGET):
+    """生成不超过 token 预算的数据集摘要（结构、类型、缺失率、基数、数值范围与样本值）"""
+    column_stats = [_describe_column(df.iloc[:, i]) for i in range(len(df.columns))]
+    return _format_digest(len(df), list(df.columns), column_stats, token_budget)
+
+
+def get_profile(df, data_fingerprint=None):
+    """获取数据集概况，按数据集指纹缓存并在后台线程中计算；没有指纹时同步计算"""
+    if data_fingerprint is None:
+        profile = DatasetProfile(df)
+        profile.compute(df)
+        return profile
+
+    with _profile_cache_lock:
+        profile = _profile_cache.get(data_fingerprint)
+        if profile is not None:
+            _profile_cache.move_to_end(data_fingerprint)
+            return profile
+        profile = DatasetProfile(df)
+        _profile_cache[data_fingerprint] = profile
+        while len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+    _profile_executor.submit(profile.compute, df)
+    return profile
+
+
+def get_digest(df, data_fingerprint=None, token_budget=DIGEST_TOKEN_BUDGET):
+    """按数据集指纹复用数据集概况生成摘要，同一数据集只统计一次"""
+    if data_fingerprint is None:
+        return build_digest(df, token_budget)
+    return get_profile(df, data_fingerprint).digest(token_budget)
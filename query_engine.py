@@ -0,0 +1,172 @@
+import os
+import threading
+
+import duckdb
+
+from profiling import DIGEST_TOKEN_BUDGET, estimate_tokens
+from storage import atomic_write, columnar_path, load_cached
+
+# DuckDB 查询的内存上限，超出部分溢写到临时目录，从而支持大于内存的数据
+DUCKDB_MEMORY_LIMIT = os.environ.get("DUCKDB_MEMORY_LIMIT", "2GB")
+DUCKDB_TEMP_DIR = os.path.join('cache', 'duckdb_tmp')
+# SQL 工具返回给模型的最大行数
+MAX_RESULT_ROWS = 200
+# 模型生成的单条 SQL 的最长执行时间（秒），超时后中断查询
+SQL_TIMEOUT_SECONDS = float(os.environ.get("SQL_TIMEOUT_SECONDS", "30"))
+TABLE_NAME = 'data'
+
+
+def _quote(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class DuckDBDataset:
+    """基于 DuckDB 的惰性数据集句柄，数据保留在磁盘上的 Parquet 文件中按需查询"""
+
+    def __init__(self, parquet_path):
+        self.parquet_path = parquet_path
+        os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+        self._conn = duckdb.connect(database=':memory:')
+        self._conn.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+        self._conn.execute(f"SET temp_directory = {_quote(DUCKDB_TEMP_DIR)}")
+        self._conn.execute(f"CREATE VIEW {TABLE_NAME} AS SELECT * FROM read_parquet({_quote(parquet_path)})")
+        # 【修复】SQL 由模型生成，只允许读取本数据集的 Parquet 文件和溢写临时目录，禁止访问其他文件、
+        # 写出文件和安装扩展，并锁定配置防止被 SET 改回
+        self._conn.execute(f"SET allowed_paths = [{_quote(parquet_path)}]")
+        self._conn.execute(f"SET allowed_directories = [{_quote(DUCKDB_TEMP_DIR)}]")
+        self._conn.execute("SET enable_external_access = false")
+        self._conn.execute("SET lock_configuration = true")
+        self._lock = threading.Lock()
+        self._num_rows = None
+        self._columns = None
+
+    def _cursor(self):
+        # 每次查询使用独立游标，多个会话线程可以同时查询同一个数据集
+        with self._lock:
+            return self._conn.cursor()
+
+    def query(self, sql, limit=None, params=None, timeout=None):
+        """执行 SQL 并以 DataFrame 返回结果，limit 用于限制返回行数，超过 timeout 秒时中断并抛出 duckdb.InterruptException"""
+        cursor = self._cursor()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, cursor.interrupt)
+            timer.daemon = True
+            timer.start()
+        try:
+            relation = cursor.sql(sql, params=params)
+            if relation is None:
+                return None
+            if limit is not None:
+                relation = relation.limit(limit)
+            return relation.df()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cursor.close()
+
+    @property
+    def num_rows(self):
+        if self._num_rows is None:
+            self._num_rows = int(self.query(f'SELECT count(*) AS n FROM {TABLE_NAME}')['n'].iloc[0])
+        return self._num_rows
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            described = self.query(f'DESCRIBE {TABLE_NAME}')
+            self._columns = list(zip(described['column_name'], described['column_type']))
+        return self._columns
+
+    def sample(self, n=1000):
+        """读取前 n 行用于页面预览"""
+        return self.query(f'SELECT * FROM {TABLE_NAME}', limit=n)
+
+    def page(self, page, page_size, sort_by=None, ascending=True, filter_column=None, filter_text=''):
+        """在全量数据上筛选、排序并分页，只返回当前页的行和满足条件的总行数"""
+        where, params = '', []
+        if filter_text and filter_column is not None:
+            where = f'WHERE contains(lower(CAST({_quote_identifier(filter_column)} AS VARCHAR)), lower(?))'
+            params.append(filter_text)
+        total = int(self.query(f'SELECT count(*) AS n FROM {TABLE_NAME} {where}', params=params or None)['n'].iloc[0])
+        order = ''
+        if sort_by is not None:
+            order = f'ORDER BY {_quote_identifier(sort_by)} {"ASC" if ascending else "DESC"} NULLS LAST'
+        rows = self.query(f'SELECT * FROM {TABLE_NAME} {where} {order} '
+                          f'LIMIT {int(page_size)} OFFSET {int(page * page_size)}', params=params or None)
+        return rows, total
+
+    def digest(self, token_budget=DIGEST_TOKEN_BUDGET):
+        """用 DuckDB 的 SUMMARIZE 对全量数据生成不超过 token 预算的结构摘要"""
+        summary = self.query(f'SUMMARIZE {TABLE_NAME}')
+        header = f'表 {TABLE_NAME} 共 {self.num_rows} 行，{len(summary)} 列。各列信息：'
+        lines = [header]
+        used = estimate_tokens(header)
+        for i, row in enumerate(summary.itertuples(index=False)):
+            line = (f'- "{row.column_name}": {row.column_type}，缺失率 {float(row.null_percentage):.1f}%，'
+                    f'唯一值约 {row.approx_unique}，范围 [{str(row.min)[:40]}, {str(row.max)[:40]}]')
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                lines.append(f'- …… 其余 {len(summary) - i} 列已省略')
+                break
+            lines.append(line)
+            used += cost
+        return '\n'.join(lines)
+
+    def run_sql_tool(self, sql):
+        """供 Agent 调用的 SQL 工具：返回 Markdown 表格，出错时返回错误信息以便模型修正"""
+        sql = sql.strip().strip('`')
+        if sql.lower().startswith('sql'):
+            sql = sql[3:]
+        try:
+            result = self.query(sql, limit=MAX_RESULT_ROWS + 1, timeout=SQL_TIMEOUT_SECONDS)
+        except duckdb.InterruptException:
+            return f'SQL 执行超过 {SQL_TIMEOUT_SECONDS:g} 秒已中断，请使用聚合、筛选或 LIMIT 简化查询'
+        except duckdb.Error as e:
+            return f'SQL 执行出错: {e}'
+        if result is None:
+            return '执行成功，无返回结果'
+        truncated = len(result) > MAX_RESULT_ROWS
+        text = result.head(MAX_RESULT_ROWS).to_markdown(index=False, disable_numparse=True)
+        if truncated:
+            text += f'\n（仅显示前 {MAX_RESULT_ROWS} 行，请使用聚合或 LIMIT 缩小结果）'
+        return text
+
+
+def convert_csv(file_path, parquet_path):
+    """由 DuckDB 流式地把 CSV 转换为 Parquet，整个过程不需要把文件完整读入内存"""
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    conn = duckdb.connect(database=':memory:')
+    try:
+        conn.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+        atomic_write(parquet_path, lambda tmp_path: conn.execute(
+            f'COPY (SELECT * FROM read_csv_auto({_quote(file_path)})) TO {_quote(tmp_path)} (FORMAT parquet)'
+        ))
+    finally:
+        conn.close()
+
+
+def open_dataset(file_path, file_type, fingerprint, parse, sheet_name=None):
+    """打开 DuckDB 数据集：CSV 直接由 DuckDB 转换为列式缓存，其他格式复用 pandas 解析后的列式缓存"""
+    if file_type == 'csv':
+        parquet_path = columnar_path(fingerprint, sheet_name, 'duckdb')
+        if not os.path.exists(parquet_path):
+            try:
+                convert_csv(file_path, parquet_path)
+            except duckdb.Error as e:
+                # DuckDB 无法识别的编码（如 GBK）回退到 pandas 解析
+                print(e)
+                parquet_path = None
+        if parquet_path is not None:
+            return DuckDBDataset(parquet_path)
+
+    parquet_path = columnar_path(fingerprint, sheet_name)
+    if not os.path.exists(parquet_path):
+        load_cached(fingerprint, parse, sheet_name)
+    if not os.path.exists(parquet_path):
+        raise ValueError('该数据无法转换为列式格式，请关闭大文件模式后重试')
+    return DuckDBDataset(parquet_path)
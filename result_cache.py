@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+
+import pandas as pd
+
+CACHE_DIR = 'cache'
+RESULT_CACHE_PATH = os.path.join(CACHE_DIR, 'results.sqlite3')
+
+
+def normalize_query(query):
+    """规范化问题文本：统一全角/半角字符并合并多余空白"""
+    return ' '.join(unicodedata.normalize('NFKC', query).split())
+
+
+def dataframe_fingerprint(df):
+    """计算 DataFrame 内容指纹，列名、类型或任意单元格变化都会得到不同的指纹"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in df.columns], ensure_ascii=False).encode('utf-8'))
+    digest.update(json.dumps([str(t) for t in df.dtypes], ensure_ascii=False).encode('utf-8'))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        # 单元格中包含列表等不可哈希对象时退化为序列化内容
+        digest.update(df.to_json(orient='split', date_format='iso').encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """基于 SQLite 的分析结果缓存，跨会话、跨进程共享，按 TTL 过期并按 LRU 淘汰"""
+
+    def __init__(self, path=RESULT_CACHE_PATH, max_entries=5000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)')
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作使用独立连接，避免在 Streamlit 的多个脚本线程之间共享连接
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(data_fingerprint, query, model, prompt_version):
+        """由数据指纹、规范化后的问题、模型名称和提示词版本生成缓存键"""
+        raw = json.dumps([data_fingerprint, normalize_query(query), model, prompt_version], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存结果，未命中或已过期时返回 None"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, created_at FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """写入缓存结果，并清理过期条目和超出容量的最久未使用条目"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            conn.execute('DELETE FROM results WHERE created_at < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
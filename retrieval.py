@@ -0,0 +1,122 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from storage import atomic_write
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 120
+# 每个问题提供给 Agent 的最相关片段数量
+TOP_K = 6
+HASHING_DIM = 1024
+INDEX_DIR = os.path.join('cache', 'faiss')
+INDEX_CACHE_SIZE = 8
+# 设置后使用 sentence-transformers 本地模型生成向量，否则使用无需模型的哈希向量
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL")
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def split_documents(documents):
+    """把逐页文本切分为带重叠的片段，每个片段一行，保留所在页码"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", "。", "！", "？", ". ", " ", ""]
+    )
+    rows = []
+    for page_number, document in enumerate(documents, start=1):
+        page = document.metadata.get("page")
+        page = page + 1 if isinstance(page, int) else page_number
+        for chunk in splitter.split_text(document.page_content):
+            rows.append((page, chunk))
+    return pd.DataFrame(rows, columns=["Page", "Content"])
+
+
+def hashing_embedding(texts):
+    """基于字符二元组哈希的轻量向量，无需下载模型，中英文均可使用"""
+    vectors = np.zeros((len(texts), HASHING_DIM), dtype='float32')
+    for row, text in enumerate(texts):
+        text = text.lower()
+        for i in range(len(text) - 1):
+            vectors[row, zlib.crc32(text[i:i + 2].encode('utf-8')) % HASHING_DIM] += 1.0
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+@lru_cache(maxsize=1)
+def get_embedding_function():
+    """返回向量化函数 embed(texts) -> float32 数组，可通过 EMBEDDING_MODEL 环境变量替换为本地模型
+
+    【修复】本地模型加载很慢，进程内只加载一次，所有文档和请求共用
+    """
+    if not EMBEDDING_MODEL:
+        return hashing_embedding
+
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL)
+
+    def model_embedding(texts):
+        return np.asarray(model.encode(list(texts), normalize_embeddings=True), dtype='float32')
+
+    model_embedding.__name__ = f'st_{EMBEDDING_MODEL.replace("/", "_")}'
+    return model_embedding
+
+
+class DocumentIndex:
+    """文档片段及其 FAISS 向量索引，按问题检索最相关的片段"""
+
+    def __init__(self, chunks, index, embed):
+        self.chunks = chunks
+        self.index = index
+        self.embed = embed
+
+    def search(self, query, k=TOP_K):
+        """返回与问题最相关的 k 个片段，按原文顺序排列"""
+        if self.index.ntotal == 0:
+            return self.chunks.iloc[:0]
+        _, ids = self.index.search(self.embed([query]), min(k, self.index.ntotal))
+        ids = sorted(i for i in ids[0] if i >= 0)
+        return self.chunks.iloc[ids].reset_index(drop=True)
+
+
+def load_index(fingerprint, chunks, embed=None):
+    """加载或构建文档的 FAISS 索引，按文档指纹缓存在磁盘和进程内"""
+    embed = embed or get_embedding_function()
+    cache_key = (fingerprint, embed.__name__)
+    with _index_cache_lock:
+        document_index = _index_cache.get(cache_key)
+        if document_index is not None:
+            _index_cache.move_to_end(cache_key)
+            return document_index
+
+    index_path = os.path.join(INDEX_DIR, f'{fingerprint}_{embed.__name__}.faiss')
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+    else:
+        vectors = embed(chunks["Content"].tolist()) if len(chunks) else np.zeros((0, HASHING_DIM), dtype='float32')
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        atomic_write(index_path, lambda tmp_path: faiss.write_index(index, tmp_path))
+
+    document_index = DocumentIndex(chunks, index, embed)
+    with _index_cache_lock:
+        _index_cache[cache_key] = document_index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return document_index
+
+
+def format_context(chunks):
+    """把检索到的片段整理为提示词中的上下文"""
+    return "\n\n".join(f"[第 {row.Page} 页] {row.Content}" for row in chunks.itertuples(index=False))
@@ -0,0 +1,345 @@
+"""在预先启动的沙箱进程中执行 Agent 生成的 pandas 代码
+
+数据集导出为 Arrow IPC 文件，工作进程以内存映射方式读取，不经过进程间管道传输，多个进程共享操作系统的页缓存；
+每次执行都有 CPU 时间、内存和超时限制，失控的代码只会终止沙箱进程，不会阻塞或拖垮页面服务进程。
+"""
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+import pyarrow as pa
+from pyarrow import feather
+from langchain_core.tools import Tool
+
+from storage import atomic_write
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，只能依靠超时终止进程
+    resource = None
+
+# 沙箱进程数量，设为 0 时在当前进程中执行代码（与之前的行为相同）
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 单次执行的墙钟超时、CPU 时间上限（秒）和沙箱进程的内存上限（MB）
+SANDBOX_TIMEOUT = float(os.environ.get("SANDBOX_TIMEOUT", "60"))
+SANDBOX_CPU_SECONDS = int(os.environ.get("SANDBOX_CPU_SECONDS", "30"))
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", "2048"))
+# 所有沙箱进程都被占用时，执行代码前最多等待多少秒（会话在整个 Agent 运行期间占用进程，包括等待模型回复的时间）
+SANDBOX_ACQUIRE_TIMEOUT = float(os.environ.get("SANDBOX_ACQUIRE_TIMEOUT", "30"))
+# 每个沙箱进程执行多少次后替换为新进程，避免内存碎片和残留状态不断累积
+SANDBOX_MAX_TASKS = int(os.environ.get("SANDBOX_MAX_TASKS", "200"))
+# Arrow IPC 文件目录：cache/arrow/<数据集指纹>.arrow
+ARROW_DIR = os.path.join('cache', 'arrow')
+# 每个沙箱进程内保留的已加载数据集数量
+WORKER_FRAMES = 2
+# 内存分配失败时沙箱进程可能的退出信号：被系统 OOM 终止、原生代码访问失败的内存或在分配失败后中止
+MEMORY_SIGNALS = tuple(-getattr(signal, name) for name in ('SIGKILL', 'SIGSEGV', 'SIGABRT') if hasattr(signal, name))
+
+_pool = None
+_pool_lock = threading.Lock()
+_session = ContextVar('sandbox_session', default=None)
+
+
+def export_dataset(df, data_fingerprint):
+    """把 DataFrame 导出为未压缩的 Arrow IPC 文件供沙箱进程内存映射读取，同一数据集只导出一次"""
+    path = os.path.join(ARROW_DIR, f'{data_fingerprint}.arrow')
+    if not os.path.exists(path):
+        os.makedirs(ARROW_DIR, exist_ok=True)
+        atomic_write(path, lambda tmp_path: feather.write_feather(df, tmp_path, compression='uncompressed'))
+    return path
+
+
+def _set_limit(name, soft):
+    limit = getattr(resource, name, None)
+    if limit is None:
+        return
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY and soft != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    try:
+        resource.setrlimit(limit, (soft, hard))
+    except (ValueError, OSError) as e:
+        print(e)
+
+
+def _limit_cpu(seconds):
+    """CPU 时间限制是进程累计值，每次执行前设为“已用时间 + 本次上限”，超出时进程收到 SIGXCPU 被终止"""
+    if resource is None:
+        return
+    if not seconds:
+        _set_limit('RLIMIT_CPU', resource.RLIM_INFINITY)
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _set_limit('RLIMIT_CPU', math.ceil(usage.ru_utime + usage.ru_stime) + seconds)
+
+
+def collect_frames(namespace, injected, max_rows):
+    """取出代码执行后变量空间中新生成的 DataFrame/Series（不含 df 本身和传入时未改动的变量），行数过多的不保留"""
+    import pandas as pd
+
+    return {name: value for name, value in namespace.items()
+            if isinstance(value, (pd.DataFrame, pd.Series)) and name != 'df' and not name.startswith('_')
+            and value is not injected.get(name) and len(value) <= max_rows}
+
+
+def _worker_main(conn, memory_mb):
+    """沙箱进程主循环
+
+    ('run', 数据集路径, 代码, 变量, CPU 上限)：变量不为 None 时以这些变量和数据集重建变量空间，返回执行输出的文本；
+    ('collect', 最大行数)：返回变量空间中新生成的 DataFrame/Series
+    """
+    import pandas as pd
+    from langchain_experimental.tools.python.tool import PythonAstREPLTool
+
+    # 写时复制：每次会话拿到的是共享数据的浅拷贝，生成的代码修改 df 不会影响后续会话
+    pd.set_option('mode.copy_on_write', True)
+    if resource is not None:
+        _set_limit('RLIMIT_CORE', 0)
+        if memory_mb:
+            # 只限制堆和匿名映射，内存映射的数据文件不计入
+            _set_limit('RLIMIT_DATA', memory_mb * 1024 * 1024)
+
+    datasets = OrderedDict()
+    tool = None
+    injected = {}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'collect':
+            try:
+                conn.send(collect_frames(tool.locals, injected, message[1]) if tool is not None else {})
+            except BaseException as e:
+                print(e)
+                conn.send({})
+            continue
+
+        _, dataset_path, code, frames, cpu_seconds = message
+        try:
+            if frames is not None or tool is None:
+                df = datasets.get(dataset_path)
+                if df is None:
+                    df = feather.read_table(dataset_path, memory_map=True).to_pandas(split_blocks=True)
+                    datasets[dataset_path] = df
+                    while len(datasets) > WORKER_FRAMES:
+                        datasets.popitem(last=False)
+                datasets.move_to_end(dataset_path)
+                injected = dict(frames or {})
+                tool = PythonAstREPLTool(locals={**injected, "df": df.copy(deep=False)})
+            _limit_cpu(cpu_seconds)
+            try:
+                output = str(tool.run(code))
+            finally:
+                _limit_cpu(0)
+        except BaseException as e:
+            output = f"{type(e).__name__}: {e}"
+        conn.send(output)
+
+
+class SandboxWorker:
+    """主进程中对一个沙箱进程的句柄"""
+
+    def __init__(self, context, memory_mb):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_mb), name='sandbox', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+    def run(self, dataset_path, code, frames, timeout, cpu_seconds):
+        self.tasks += 1
+        try:
+            self.conn.send(('run', dataset_path, code, frames, cpu_seconds))
+            if self.conn.poll(timeout):
+                return self.conn.recv()
+        except (EOFError, OSError):
+            self.process.join(1)
+            exitcode = self.process.exitcode
+            self.kill()
+            if exitcode == -getattr(signal, 'SIGXCPU', 0):
+                return f"TimeoutError: 代码执行超过 {cpu_seconds} 秒 CPU 时间，已终止。请改用向量化操作，或先筛选、聚合数据"
+            if exitcode in MEMORY_SIGNALS:
+                return f"MemoryError: 代码执行过程中沙箱进程异常退出（退出码 {exitcode}），可能超出了内存限制。请先筛选、聚合数据"
+            # 【修复】启动失败、被外部终止等与代码无关的退出不再提示内存不足，以免模型为此去缩小数据
+            return f"RuntimeError: 沙箱进程异常退出（退出码 {exitcode}），请重新执行"
+        self.kill()
+        return f"TimeoutError: 代码执行超过 {timeout:g} 秒，已终止。请改用向量化操作，或先筛选、聚合数据"
+
+    def collect(self, max_rows, timeout):
+        try:
+            self.conn.send(('collect', max_rows))
+            if self.conn.poll(timeout):
+                return self.conn.recv()
+        except (EOFError, OSError) as e:
+            print(e)
+        self.kill()
+        return {}
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """常驻的沙箱进程池：进程启动时即导入 pandas 等依赖，执行失控的进程被终止后立即补充新进程"""
+
+    def __init__(self, size=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT, cpu_seconds=SANDBOX_CPU_SECONDS,
+                 memory_mb=SANDBOX_MEMORY_MB, max_tasks=SANDBOX_MAX_TASKS):
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_tasks = max_tasks
+        # 使用 spawn 避免在多线程的 Streamlit 进程中 fork
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        for _ in range(max(1, size)):
+            self._idle.put(self._start())
+
+    def _start(self):
+        return SandboxWorker(self._context, self.memory_mb)
+
+    def acquire(self, timeout=SANDBOX_ACQUIRE_TIMEOUT):
+        """取出一个空闲进程，所有进程都在使用时最多等待 timeout 秒，超时抛出 queue.Empty"""
+        worker = self._idle.get(timeout=timeout)
+        if not worker.alive:
+            worker.kill()
+            worker = self._start()
+        return worker
+
+    def release(self, worker):
+        if not worker.alive or worker.tasks >= self.max_tasks:
+            worker.kill()
+            worker = self._start()
+        self._idle.put(worker)
+
+    def run(self, worker, dataset_path, code, frames=None):
+        return worker.run(dataset_path, code, frames, self.timeout, self.cpu_seconds)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+def get_sandbox_pool():
+    """沙箱进程池在首次使用时创建并常驻复用"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+        return _pool
+
+
+class _Session:
+    """一次 Agent 运行占用一个沙箱进程，前后步骤中定义的变量可以继续使用；frames 为连续对话中保留的中间结果"""
+
+    def __init__(self, frames=None):
+        self.frames = dict(frames or {})
+        self.pool = None
+        self.worker = None
+        self.dataset_path = None
+        self.local_tool = None
+
+    def run(self, dataset_path, code):
+        if self.worker is None:
+            self.pool = get_sandbox_pool()
+            try:
+                self.worker = self.pool.acquire()
+            except queue.Empty:
+                # 【修复】不再无限等待，以工具错误返回给模型，不会因其他会话长时间占用进程而卡住
+                return f"TimeoutError: 等待 {SANDBOX_ACQUIRE_TIMEOUT:g} 秒后仍没有空闲的沙箱进程，请稍后重新执行"
+            self.dataset_path = None
+        frames = self.frames if dataset_path != self.dataset_path else None
+        output = self.pool.run(self.worker, dataset_path, code, frames)
+        self.dataset_path = dataset_path
+        if not self.worker.alive:
+            # 进程已被终止，下一步换一个新进程，之前定义的变量不再可用
+            self.close()
+        return output
+
+    def run_local(self, df, code):
+        """未启用沙箱时在当前进程中执行"""
+        if self.local_tool is None or self.local_tool.locals.get('df') is not df:
+            from langchain_experimental.tools.python.tool import PythonAstREPLTool
+            self.local_tool = PythonAstREPLTool(locals={**self.frames, "df": df})
+        return self.local_tool.run(code)
+
+    def collect_frames(self, max_rows):
+        """取出本次运行中新生成的中间结果，需在会话结束前调用"""
+        if self.worker is not None:
+            frames = self.worker.collect(max_rows, self.pool.timeout)
+            if not self.worker.alive:
+                self.close()
+            return frames
+        if self.local_tool is not None:
+            return collect_frames(self.local_tool.locals, self.frames, max_rows)
+        return {}
+
+    def close(self):
+        if self.worker is not None:
+            self.pool.release(self.worker)
+            self.worker = None
+
+
+@contextmanager
+def sandbox_session(frames=None):
+    """在此范围内执行的代码共用同一个沙箱进程和变量空间，frames 中的变量可在代码中直接使用；只在真正执行代码时才占用进程"""
+    session = _Session(frames)
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+        session.close()
+
+
+def run_code(dataset_path, code):
+    session = _session.get()
+    if session is None:
+        with sandbox_session() as session:
+            return session.run(dataset_path, code)
+    return session.run(dataset_path, code)
+
+
+def run_local_code(df, code):
+    session = _session.get()
+    if session is None:
+        with sandbox_session() as session:
+            return session.run_local(df, code)
+    return session.run_local(df, code)
+
+
+def sandbox_tool(tool, df, data_fingerprint):
+    """返回与 Agent 原有 Python 工具同名、但在沙箱进程中执行代码的工具
+
+    未启用沙箱或数据无法导出时仍在当前进程中执行，但变量空间同样按会话隔离
+    """
+    local_tool = Tool(name=tool.name, description=tool.description, func=partial(run_local_code, df))
+    if SANDBOX_WORKERS <= 0 or data_fingerprint is None:
+        return local_tool
+    try:
+        dataset_path = export_dataset(df, data_fingerprint)
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        # 混合类型的列等无法转换为 Arrow 时仍在当前进程中执行
+        print(e)
+        return local_tool
+    # 提前创建进程池，沙箱进程在等待模型回复期间完成启动
+    get_sandbox_pool()
+    return Tool(name=tool.name, description=tool.description, func=partial(run_code, dataset_path))
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import threading
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+from tracing import record_cache
+
+UPLOAD_DIR = 'uploads'
+# 列式缓存目录：上传文件首次解析后转换为 Parquet，之后直接内存映射读取
+COLUMNAR_DIR = os.path.join(UPLOAD_DIR, 'columnar')
+# 解析逻辑变化时递增，使旧的列式缓存自动失效
+COLUMNAR_VERSION = 1
+
+# 后台预取线程池：用户查看第一个工作表时，其余工作表在后台解析
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+# 正在解析中的缓存路径 -> Future，保证同一份数据同一时间只被解析一次
+_inflight = {}
+_inflight_lock = threading.Lock()
+_prefetched = set()
+
+
+def file_fingerprint(content):
+    """计算文件内容的指纹（SHA-256）"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def path_fingerprint(file_path, chunk_size=1 << 20):
+    """分块读取磁盘上的文件计算指纹，结果与 file_fingerprint 相同"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(path, write):
+    """先写入临时文件再原子替换，避免并发会话读到写了一半的文件"""
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_upload(content, file_name):
+    """按内容寻址保存上传文件，相同内容只存储一次，返回 (指纹, 文件路径)"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fingerprint = file_fingerprint(content)
+    suffix = file_name[file_name.rfind('.'):].lower() if '.' in file_name else ''
+    file_path = os.path.join(UPLOAD_DIR, f'{fingerprint}{suffix}')
+    if not os.path.exists(file_path):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+        atomic_write(file_path, write)
+    return fingerprint, file_path
+
+
+def dataset_fingerprint(fingerprint, *parts):
+    """由文件指纹、工作表等加载参数和解析版本得到数据集指纹，无需再对 DataFrame 逐行哈希"""
+    raw = '\x1f'.join([fingerprint, str(COLUMNAR_VERSION)] + ['' if part is None else str(part) for part in parts])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def columnar_path(fingerprint, *parts):
+    """返回某个文件（及工作表等附加参数）对应的列式缓存路径"""
+    key = fingerprint
+    if any(part is not None for part in parts):
+        extra = '\x1f'.join('' if part is None else str(part) for part in parts)
+        key = f'{fingerprint}_{hashlib.sha1(extra.encode("utf-8")).hexdigest()[:16]}'
+    return os.path.join(COLUMNAR_DIR, f'v{COLUMNAR_VERSION}_{key}.parquet')
+
+
+def read_columnar(path):
+    """内存映射读取列式缓存，不存在时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path, engine='pyarrow', memory_map=True)
+    except Exception as e:
+        # 缓存文件损坏时删除，回退到重新解析原始文件
+        print(e)
+        os.remove(path)
+        return None
+
+
+def write_columnar(df, path):
+    """将 DataFrame 写入列式缓存，无法转换的数据（如混合类型列）直接跳过"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        atomic_write(path, lambda tmp_path: df.to_parquet(tmp_path, engine='pyarrow', index=False))
+        return True
+    except (ValueError, TypeError, OSError) as e:
+        print(e)
+        return False
+
+
+def _parse_once(path, parse):
+    """解析并写入列式缓存；若其他线程正在解析同一份数据，则等待其结果"""
+    with _inflight_lock:
+        future = _inflight.get(path)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[path] = future
+    if not is_owner:
+        return future.result()
+
+    try:
+        # 获得解析权之前可能已有其他线程写好了缓存
+        df = read_columnar(path)
+        if df is None:
+            df = parse()
+            if not df.empty:
+                write_columnar(df, path)
+        future.set_result(df)
+        return df
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(path, None)
+
+
+def load_cached(fingerprint, parse, *parts):
+    """优先读取列式缓存，未命中时调用 parse() 解析原始文件并写入缓存"""
+    path = columnar_path(fingerprint, *parts)
+    df = read_columnar(path)
+    record_cache('columnar', df is not None)
+    if df is not None:
+        return df
+    return _parse_once(path, parse)
+
+
+def _prefetch_one(path, parse, parts):
+    try:
+        if not os.path.exists(path):
+            _parse_once(path, lambda: parse(*parts))
+    except Exception as e:
+        # 预取失败不影响前台，用户真正选择该数据时会重新解析并报告错误
+        print(e)
+
+
+def prefetch(fingerprint, parse, parts_list):
+    """在后台线程池中预先解析并缓存多份数据（如 Excel 的其余工作表），parse(*parts) 返回 DataFrame"""
+    for parts in parts_list:
+        path = columnar_path(fingerprint, *parts)
+        with _inflight_lock:
+            if path in _prefetched or path in _inflight:
+                continue
+            _prefetched.add(path)
+        if not os.path.exists(path):
+            _prefetch_executor.submit(_prefetch_one, path, parse, parts)
+
+
+def list_sheet_names(file_path):
+    """只读取工作簿元数据获取工作表名称，不解析任何单元格"""
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            root = ET.fromstring(zf.read('xl/workbook.xml'))
+        # 兼容 transitional 与 strict 两种 OOXML 命名空间
+        return [node.get('name') for node in root.iter() if node.tag.rsplit('}', 1)[-1] == 'sheet']
+    except (zipfile.BadZipFile, KeyError):
+        # 旧版 .xls 等非 zip 格式交给 pandas 处理
+        with pd.ExcelFile(file_path) as xls:
+            return xls.sheet_names
@@ -0,0 +1,197 @@
+"""Agent 结果的结构校验与本地修复
+
+模型的最终输出经常是“几乎正确”的 JSON：包在 ```json 代码块里、使用单引号、键名没有引号、末尾多出说明文字等。
+这里先在本地修复并按 answer/table/bar/line/pie 的结构校验，只有本地无法修复时才需要再请求模型。
+"""
+import ast
+import json
+import math
+import re
+
+from langchain.agents.output_parsers.react_single_input import ReActSingleInputOutputParser
+from langchain_core.agents import AgentFinish
+from langchain_core.exceptions import OutputParserException
+
+CHART_KEYS = ('bar', 'line', 'pie')
+RESULT_KEYS = ('answer', 'table') + CHART_KEYS
+
+# 提供给 JSON 模式整理结果时使用的结构说明
+RESULT_SCHEMA = """只返回以下五种 JSON 对象之一：
+{"answer": "简明的文字回答"}
+{"table": {"columns": ["列名1", "列名2"], "data": [["值1", "值2"]]}}
+{"bar": {"columns": ["类别1", "类别2"], "data": [数值1, 数值2]}}
+{"line": {"columns": ["点名1", "点名2"], "data": [数值1, 数值2]}}
+{"pie": {"columns": ["扇区1", "扇区2"], "data": [数值1, 数值2]}}"""
+
+ACTION_PATTERN = re.compile(r"Action\s*\d*\s*:[\s]*(.*?)[\s]*Action\s*\d*\s*Input\s*\d*\s*:", re.DOTALL)
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+UNQUOTED_KEY_PATTERN = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:')
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+# 图表数据含缺失值而改为表格展示时使用的列名
+CHART_TABLE_COLUMNS = ['名称', '数值']
+PYTHON_LITERALS = {'true': 'True', 'false': 'False', 'null': 'None'}
+
+BOTH_ACTION_AND_ANSWER_HINT = ("不要在同一步中同时给出 Action 和 Final Answer：需要查询数据时只写 Action，"
+                               "拿到 Observation 后再单独输出 Final Answer。")
+INVALID_RESULT_HINT = "Final Answer 不是有效的结果 JSON，请直接重新输出 Final Answer，不要再次查询数据。" + RESULT_SCHEMA
+
+
+def _json_candidates(text):
+    """从文本中依次找出可能是 JSON 对象的片段：代码块内容、以及每个配对完整的 {...}"""
+    blocks = CODE_FENCE_PATTERN.findall(text) or [text]
+    for block in blocks:
+        start = block.find('{')
+        while start != -1:
+            depth, quote, escaped = 0, None, False
+            for end in range(start, len(block)):
+                char = block[end]
+                if quote:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == quote:
+                        quote = None
+                elif char in '"\'':
+                    quote = char
+                elif char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if depth == 0:
+                        yield block[start:end + 1]
+                        break
+            start = block.find('{', start + 1)
+
+
+def _literal_eval(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _loads(candidate):
+    """依次尝试标准 JSON、Python 字面量和宽松 JSON 解析"""
+    try:
+        return json.loads(candidate, strict=False)
+    except ValueError:
+        pass
+    # 【修复】单引号字符串、True/None 等 Python 写法先按原文解析，给键名补引号会改动字符串内“b: c”之类的内容
+    result = _literal_eval(candidate)
+    if result is not None:
+        return result
+    fixed = TRAILING_COMMA_PATTERN.sub(r'\1', UNQUOTED_KEY_PATTERN.sub(r'\1"\2":', candidate))
+    try:
+        return json.loads(fixed, strict=False)
+    except ValueError:
+        pass
+    return _literal_eval(re.sub(r'\b(true|false|null)\b', lambda m: PYTHON_LITERALS[m.group(1)], fixed))
+
+
+def _to_float(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value) if isinstance(value, (int, float)) else float(str(value).replace(',', '').strip())
+    except (ValueError, OverflowError):
+        return None
+
+
+def _is_missing(value):
+    number = _to_float(value)
+    return value is None or (number is not None and not math.isfinite(number))
+
+
+def _to_number(value):
+    """转换为可绘图的数值；NaN、无穷大和无法识别的值返回 None"""
+    number = _to_float(value)
+    if number is None or not math.isfinite(number):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def validate_result(result):
+    """按结果结构校验并整理，返回只包含一种结果类型的 dict；不符合结构时返回 None"""
+    if not isinstance(result, dict):
+        return None
+    key = next((key for key in RESULT_KEYS if key in result), None)
+    if key is None:
+        return None
+    value = result[key]
+    if key == 'answer':
+        if isinstance(value, (dict, list)) or value is None:
+            return None
+        return {'answer': str(value)}
+
+    if not isinstance(value, dict) or not isinstance(value.get('columns'), list) or \
+            not isinstance(value.get('data'), list):
+        return None
+    columns = value['columns']
+    if key == 'table':
+        rows = []
+        for row in value['data']:
+            if isinstance(row, dict):
+                row = [row.get(column) for column in columns]
+            if not isinstance(row, list) or len(row) != len(columns):
+                return None
+            rows.append(row)
+        return {'table': {'columns': [str(column) for column in columns], 'data': rows}}
+
+    numbers = [_to_number(item) for item in value['data']]
+    if len(numbers) != len(columns):
+        return None
+    if any(number is None for number in numbers):
+        if not all(number is not None or _is_missing(item) for number, item in zip(numbers, value['data'])):
+            return None
+        # 【修复】含有缺失值（null、NaN、无穷大）时无法绘图，改为以表格展示，不再在绘图时出错
+        return {'table': {'columns': CHART_TABLE_COLUMNS,
+                          'data': [[str(column), number] for column, number in zip(columns, numbers)]}}
+    return {key: {'columns': [str(column) for column in columns], 'data': numbers}}
+
+
+def parse_result(text):
+    """从模型输出中取出第一个符合结果结构的 JSON 对象，无法修复时返回 None"""
+    if isinstance(text, dict):
+        return validate_result(text)
+    for candidate in _json_candidates(str(text)):
+        result = validate_result(_loads(candidate))
+        if result is not None:
+            return result
+    return None
+
+
+class ResultOutputParser(ReActSingleInputOutputParser):
+    """ReAct 输出解析：最终答案在本地修复为标准 JSON；格式不规范但已包含有效结果时直接结束，不再多跑一轮"""
+
+    def parse(self, text):
+        try:
+            step = super().parse(text)
+        except OutputParserException as e:
+            if ACTION_PATTERN.search(text):
+                # 同时给出了 Action 和 Final Answer，此时的答案是在看到查询结果之前写的，不能采用
+                raise OutputParserException(str(e), observation=BOTH_ACTION_AND_ANSWER_HINT,
+                                            llm_output=text, send_to_llm=True) from e
+            result = parse_result(text)
+            if result is None:
+                raise
+            return AgentFinish({"output": json.dumps(result, ensure_ascii=False)}, text)
+
+        if not isinstance(step, AgentFinish):
+            return step
+        output = step.return_values["output"]
+        result = parse_result(output)
+        if result is None:
+            if '{' in output or not output.strip():
+                raise OutputParserException(f"Invalid result JSON: `{output}`", observation=INVALID_RESULT_HINT,
+                                            llm_output=text, send_to_llm=True)
+            # 只有一句文字时按文字回答处理
+            result = {"answer": output.strip('`"\' \n')}
+        return AgentFinish({"output": json.dumps(result, ensure_ascii=False)}, step.log)
+
+    @property
+    def _type(self):
+        return "react-single-input-result"
+
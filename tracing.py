@@ -0,0 +1,300 @@
+"""请求级别的埋点：记录各阶段耗时、模型 token 数、Agent 迭代次数、工具执行时间和缓存命中情况
+
+设置 TRACE_FILE 后，每个请求结束时以 OpenTelemetry（OTLP/JSON）格式追加一行到该文件；
+设置 METRICS_PORT 后，在本地端口以 Prometheus 文本格式提供 /metrics 汇总指标。
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+SERVICE_NAME = 'text-agent'
+
+_current_trace = ContextVar('current_trace', default=None)
+_trace_file_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+# 进程内累计指标，供 /metrics 使用
+_stage_seconds = defaultdict(float)
+_stage_counts = defaultdict(int)
+_counters = defaultdict(int)
+_metrics_server = None
+
+
+class Span:
+    def __init__(self, trace_id, name, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def end(self, error=None):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.error = error
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': str(self.error)} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Trace:
+    """一次请求（上传加载或一次提问）的所有阶段及计数"""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(self.trace_id, name, attributes=attributes)
+        self.spans = [self.root]
+        self.counters = defaultdict(int)
+        self._stack = [self.root]
+        self._lock = threading.Lock()
+
+    def start_span(self, name, parent=None, **attributes):
+        with self._lock:
+            parent = parent or self._stack[-1]
+            span = Span(self.trace_id, name, parent.span_id, attributes)
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = self.start_span(name, **attributes)
+        self._stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            span.end()
+            self._stack.remove(span)
+            _record_stage(name, span.duration)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+        with _metrics_lock:
+            _counters[name] += value
+
+    def summary(self):
+        """供调试面板展示：各阶段耗时（同名阶段累加）以及各项计数"""
+        stages = defaultdict(float)
+        for span in self.spans[1:]:
+            stages[span.name] += span.duration
+        return {
+            'name': self.root.name,
+            'total_seconds': round(self.root.duration, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def to_otlp(self):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [span.to_otlp() for span in self.spans]}],
+        }]}
+
+
+def _record_stage(name, seconds):
+    with _metrics_lock:
+        _stage_seconds[name] += seconds
+        _stage_counts[name] += 1
+
+
+def _export(trace):
+    if not TRACE_FILE:
+        return
+    line = json.dumps(trace.to_otlp(), ensure_ascii=False)
+    with _trace_file_lock:
+        os.makedirs(os.path.dirname(TRACE_FILE) or '.', exist_ok=True)
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """开始一次请求的追踪，期间调用的 stage/count 都记录到这个 Trace，结束时导出"""
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root.end(e)
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.root.end()
+        _record_stage(name, trace.root.duration)
+        _export(trace)
+
+
+@contextmanager
+def stage(name, **attributes):
+    """记录一个阶段的耗时；当前没有进行中的追踪时只累计到进程指标"""
+    trace = current_trace()
+    if trace is None:
+        started = time.perf_counter()
+        try:
+            yield None
+        finally:
+            _record_stage(name, time.perf_counter() - started)
+        return
+    with trace.span(name, **attributes) as span:
+        yield span
+
+
+def count(name, value=1):
+    trace = current_trace()
+    if trace is not None:
+        trace.count(name, value)
+    else:
+        with _metrics_lock:
+            _counters[name] += value
+
+
+def record_cache(cache_name, hit):
+    """记录一次缓存查询的结果"""
+    count(f'cache.{cache_name}.{"hit" if hit else "miss"}')
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """把 Agent 的每次模型调用和工具执行记录为 Trace 中的子阶段，并统计 token 数和迭代次数"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._spans = {}
+
+    def _start(self, run_id, name, **attributes):
+        self._spans[run_id] = self.trace.start_span(name, **attributes)
+
+    def _end(self, run_id, error=None):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.end(error)
+            _record_stage(span.name, span.duration)
+        return span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.trace.count('llm.calls')
+        self._start(run_id, 'llm')
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._end(run_id)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                prompt_tokens += usage.get('input_tokens', 0)
+                completion_tokens += usage.get('output_tokens', 0)
+        if not prompt_tokens and response.llm_output:
+            usage = response.llm_output.get('token_usage') or {}
+            prompt_tokens = usage.get('prompt_tokens', 0)
+            completion_tokens = usage.get('completion_tokens', 0)
+        self.trace.count('tokens.prompt', prompt_tokens)
+        self.trace.count('tokens.completion', completion_tokens)
+        if span is not None:
+            span.attributes.update({'llm.prompt_tokens': prompt_tokens, 'llm.completion_tokens': completion_tokens})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_agent_action(self, action, **kwargs):
+        self.trace.count('agent.iterations')
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, 'tool', **{'tool.name': (serialized or {}).get('name', ''), 'tool.input': input_str[:500]})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is not None:
+            self.trace.count('tool.calls')
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+        self.trace.count('tool.errors')
+
+
+def _metric_name(name):
+    return 'text_agent_' + name.replace('.', '_')
+
+
+def render_metrics():
+    """以 Prometheus 文本格式输出进程内累计指标"""
+    with _metrics_lock:
+        lines = ['# TYPE text_agent_stage_seconds summary']
+        for name in sorted(_stage_seconds):
+            lines.append(f'text_agent_stage_seconds_sum{{stage="{name}"}} {_stage_seconds[name]:.6f}')
+            lines.append(f'text_agent_stage_seconds_count{{stage="{name}"}} {_stage_counts[name]}')
+        for name in sorted(_counters):
+            lines.append(f'# TYPE {_metric_name(name)}_total counter')
+            lines.append(f'{_metric_name(name)}_total {_counters[name]}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    """在后台线程中启动 /metrics 服务，进程内只启动一次；port 为 0 时不启动"""
+    global _metrics_server
+    with _metrics_lock:
+        if _metrics_server is not None or not port:
+            return _metrics_server
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        _metrics_server.daemon_threads = True
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
@@ -1,8 +1,22 @@
-import json
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableSequence
+from langchain_core.tools import Tool
+from conversation import CONVERSATION_FRAME_ROWS
+from fastpath import answer_simple_query
+from profiling import get_digest
+from query_engine import TABLE_NAME, DuckDBDataset
+from retrieval import DocumentIndex, format_context
+from tracing import TracingCallbackHandler, count, current_trace, record_cache, stage
 
+# 放在提示词最前面的固定说明；提示词按“固定说明 → 工具 → 数据集摘要 → 对话历史 → 当前问题”的顺序拼接，
+# 越稳定的部分越靠前，模型服务可以缓存相同的前缀
 PROMPT_TEMPLATE = """你是一位专业的数据分析助手，你的回应内容严格取决于用户的请求内容。请始终遵循以下步骤和格式规范：
 
 1.  **思考阶段 (Thought)**：
@@ -11,6 +25,7 @@ PROMPT_TEMPLATE = """你是一位专业的数据分析助手，你的回应内
 
 2.  **行动阶段 (Action)**：
     * 根据你的分析结果，严格选择以下对应的JSON格式进行输出。**只返回一个JSON对象**。
+    * 一旦查询结果已经足以回答请求，立即给出 Final Answer，不要再重复查询或验证。
 
     * **纯文字回答**: 当用户只寻求文字解释或总结时使用。
         ```json
@@ -45,34 +60,252 @@ PROMPT_TEMPLATE = """你是一位专业的数据分析助手，你的回应内
     * **正确案例**：`{"columns": ["product", "sales"], "data": [["A001", 200]]}`
 
 注意：响应数据的 "output" 字段中不要包含任何换行符、制表符或任何其他非JSON格式的符号。你的最终输出必须是一个可以直接被 `json.loads()` 解析的有效JSON字符串。
-
-当前用户请求如下：
 """
 
+# 提示词版本：模板内容变化后自动改变，使旧的缓存结果失效
+PROMPT_VERSION = hashlib.sha256(PROMPT_TEMPLATE.encode('utf-8')).hexdigest()[:12]
 
-def dataframe_agent(df, query):
-    model = ChatOpenAI(
-        model="gemini-2.5-flash",
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-        api_key=st.secrets["API_KEY"],
-        temperature=0,
-        max_tokens=8192
+# 用数据集摘要替代 Agent 默认放入提示词的 df.head() 原始行
+DIGEST_SUFFIX = """
+以下是数据集 `df` 的结构摘要（并非完整数据，具体数值请使用工具查询）：
+{digest}
+
+{history}Begin!
+Question: {input}
+{agent_scratchpad}"""
+
+SQL_PREFIX = f"""
+You are working with a DuckDB table named `{TABLE_NAME}` that may be larger than memory.
+Always aggregate, filter or use LIMIT in SQL instead of selecting all rows.
+You should use the tools below to answer the question posed of you:"""
+
+MODEL_NAME = os.environ.get("LLM_MODEL", "gemini-2.5-flash")
+# 可通过环境变量指向本地 OpenAI 兼容服务（如 bench/mock_llm.py）
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+
+# 每个数据集构建好的 Agent 会被缓存复用，这里限制缓存的数据集数量
+AGENT_CACHE_SIZE = 8
+_agent_cache = OrderedDict()
+_agent_cache_lock = threading.Lock()
+
+# Agent 最多执行的步数；输出中已包含有效结果时会提前结束，用不满这个上限
+AGENT_MAX_ITERATIONS = int(os.environ.get("AGENT_MAX_ITERATIONS", "10"))
+# 本地无法修复最终输出时，交给 JSON 模式整理的最近几步查询结果及每步的最大长度
+FORMAT_CONTEXT_STEPS = 3
+FORMAT_CONTEXT_CHARS = 2000
+
+FALLBACK_RESULT = {"answer": "暂时无法提供分析结果，请稍后重试！"}
+
+
+def escape_template(text):
+    """转义花括号，避免文本被当作提示词模板变量"""
+    return text.replace("{", "{{").replace("}", "}}")
 
+
+def get_api_key():
+    """优先读取环境变量 API_KEY，未设置时读取 Streamlit 的 secrets，命令行和后台任务中无需 Streamlit 配置"""
+    return os.environ.get("API_KEY") or st.secrets["API_KEY"]
+
+
+@lru_cache(maxsize=None)
+def get_llm(api_key, model=MODEL_NAME, base_url=BASE_URL):
+    """进程内共享的 LLM 客户端，底层 HTTP 连接池保持长连接，避免每次提问都重新握手"""
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=120),
+        timeout=httpx.Timeout(120, connect=10),
+    )
+    return ChatOpenAI(
+        model=model,
+        base_url=base_url,
+        api_key=api_key,
+        temperature=0,
+        max_tokens=8192,
+        # 流式输出时也返回 token 用量，供埋点统计
+        stream_usage=True,
+        http_client=http_client
     )
-    agent = create_pandas_dataframe_agent(
+
+
+def build_agent(model, df, data_fingerprint=None):
+    from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+    from langchain_experimental.agents.agent_toolkits.pandas.prompt import PREFIX
+    from sandbox import sandbox_tool
+    from structured_output import ResultOutputParser
+
+    digest = get_digest(df, data_fingerprint)
+    suffix = DIGEST_SUFFIX.replace("{digest}", escape_template(digest))
+    executor = create_pandas_dataframe_agent(
         llm=model,
         df=df,
+        prefix=escape_template(PROMPT_TEMPLATE) + PREFIX,
+        suffix=suffix,
+        include_df_in_prompt=None,
         agent_executor_kwargs={"handle_parsing_errors": True},
-        max_iterations=32,
+        max_iterations=AGENT_MAX_ITERATIONS,
+        return_intermediate_steps=True,
         allow_dangerous_code=True,
         verbose=True
     )
+    # create_pandas_dataframe_agent 不支持指定输出解析器，这里替换 ReAct 链末尾的解析器
+    runnable = executor.agent.runnable
+    executor.agent.runnable = RunnableSequence(*runnable.steps[:-1], ResultOutputParser())
+    # 生成的代码在沙箱进程中执行，工具名称和描述不变，提示词无需改动
+    executor.tools = [sandbox_tool(tool, df, data_fingerprint) for tool in executor.tools]
+    return executor
+
+
+def build_sql_agent(model, dataset):
+    """大文件模式：Agent 只能通过 SQL 工具在 DuckDB 中查询数据，不会把数据整体载入内存"""
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
+    from structured_output import ResultOutputParser
+
+    sql_tool = Tool(
+        name="duckdb_sql",
+        func=dataset.run_sql_tool,
+        description=f"Execute a DuckDB SQL query against table `{TABLE_NAME}` and return the result as a table. "
+                    f"Input should be a single valid SQL statement."
+    )
+    digest = dataset.digest()
+    suffix = DIGEST_SUFFIX.replace("数据集 `df`", f"数据表 `{TABLE_NAME}`").replace("{digest}", escape_template(digest))
+    prompt = PromptTemplate.from_template("\n\n".join([escape_template(PROMPT_TEMPLATE) + SQL_PREFIX, "{tools}",
+                                                         FORMAT_INSTRUCTIONS, suffix]))
+    return AgentExecutor(
+        agent=create_react_agent(model, [sql_tool], prompt, output_parser=ResultOutputParser()),
+        tools=[sql_tool],
+        handle_parsing_errors=True,
+        max_iterations=AGENT_MAX_ITERATIONS,
+        return_intermediate_steps=True,
+        verbose=True
+    )
+
+
+def get_agent(df, data_fingerprint=None):
+    """获取数据集对应的 Agent，同一数据集的后续提问复用已构建的 Agent；df 也可以是 DuckDBDataset"""
+    model = get_llm(get_api_key())
+    if isinstance(df, DuckDBDataset):
+        build = build_sql_agent
+    else:
+        build = partial(build_agent, data_fingerprint=data_fingerprint)
+    if data_fingerprint is None:
+        with stage('build_agent'):
+            return build(model, df)
+
+    cache_key = (data_fingerprint, model.model_name, type(df).__name__)
+    with _agent_cache_lock:
+        agent = _agent_cache.get(cache_key)
+        if agent is not None:
+            _agent_cache.move_to_end(cache_key)
+    record_cache('agent', agent is not None)
+    if agent is not None:
+        return agent
+
+    with stage('build_agent'):
+        agent = build(model, df)
+    with _agent_cache_lock:
+        _agent_cache[cache_key] = agent
+        _agent_cache.move_to_end(cache_key)
+        while len(_agent_cache) > AGENT_CACHE_SIZE:
+            _agent_cache.popitem(last=False)
+    return agent
+
+
+def format_result(query, output, intermediate_steps=None, callbacks=None):
+    """Agent 的最终输出在本地无法修复时，用 JSON 模式让模型按结果结构重新整理一次，而不是整体重跑分析"""
+    from structured_output import RESULT_SCHEMA, parse_result
+
+    observations = "\n".join(str(observation)[:FORMAT_CONTEXT_CHARS]
+                              for _, observation in (intermediate_steps or [])[-FORMAT_CONTEXT_STEPS:])
+    messages = [
+        ("system", "你负责把数据分析结论整理为 JSON。" + RESULT_SCHEMA),
+        ("human", f"用户请求：{query}\n\n分析过程中的查询结果：\n{observations or '无'}\n\n分析结论：\n{output}"),
+    ]
+    model = get_llm(get_api_key()).bind(response_format={"type": "json_object"})
+    return parse_result(model.invoke(messages, config={"callbacks": callbacks} if callbacks else None).content)
+
+
+def cached_dataframe_agent(result_cache, df, query, data_fingerprint, callbacks=None, conversation=None):
+    """先查询持久化结果缓存，未命中时再调用 AI 分析并写入缓存
+
+    conversation 为连续对话时，追问的答案依赖之前的对话内容，不读写结果缓存
+    """
+    if conversation is not None and conversation.turns:
+        return dataframe_agent(df, query, data_fingerprint, callbacks=callbacks, conversation=conversation)
+
+    cache_key = result_cache.make_key(data_fingerprint, query, MODEL_NAME, PROMPT_VERSION)
+    result = result_cache.get(cache_key)
+    record_cache('result', result is not None)
+    if result is None:
+        result = dataframe_agent(df, query, data_fingerprint, callbacks=callbacks, conversation=conversation)
+        # 失败的兜底回答不写入缓存，下次提问时重新分析
+        if result != FALLBACK_RESULT:
+            result_cache.set(cache_key, result)
+    elif conversation is not None:
+        conversation.add_turn(query, result)
+    return result
+
+
+def dataframe_agent(df, query, data_fingerprint=None, callbacks=None, conversation=None):
+    """调用 Agent 分析数据，callbacks 可用于实时接收每一步的思考、工具调用和结果
+
+    df 为 DocumentIndex 时，只把与问题最相关的文档片段交给 Agent，提问成本与文档长度无关；
+    conversation 为连续对话时，之前的提问历史放入提示词，之前生成的中间结果可在代码中直接使用，本轮结果也记入对话
+    """
+    question = query
+    history = conversation.history() if conversation is not None else ""
+    # 求和、平均值、前 N、分组汇总、按月趋势等常见问题直接用 pandas 计算，不调用模型；追问可能依赖上文，不走快速路径
+    if not history:
+        try:
+            with stage('fast_path'):
+                result = answer_simple_query(df, query)
+        except Exception as e:
+            # 【修复】例如按包含列表、字典的列分组时会出错，此时当作无法直接回答，交给 Agent 处理
+            print(e)
+            result = None
+        if result is not None:
+            count('fast_path.hit')
+            if conversation is not None:
+                conversation.add_turn(question, result)
+            return result
+
+    if isinstance(df, DocumentIndex):
+        with stage('retrieval'):
+            df = df.search(query)
+        query = f"{query}\n\n以下是文档中与该请求最相关的片段（也可以在 df 的 Content 列中查看）：\n{format_context(df)}"
+        data_fingerprint = None
+
+    # 模型客户端、Agent 和沙箱相关的依赖导入较慢，在第一次真正需要调用模型时才导入
+    from sandbox import sandbox_session
+    from structured_output import parse_result
 
-    prompt = PROMPT_TEMPLATE + query
+    agent = get_agent(df, data_fingerprint)
 
+    trace = current_trace()
+    if trace is not None:
+        callbacks = list(callbacks or []) + [TracingCallbackHandler(trace)]
     try:
-        response = agent.invoke({"input": prompt})
-        return json.loads(response["output"])
+        frames = {}
+        with stage('agent_run'), sandbox_session(conversation.frames if conversation is not None else None) as session:
+            response = agent.invoke({"input": query, "history": history},
+                                    config={"callbacks": callbacks} if callbacks else None)
+            if conversation is not None:
+                frames = session.collect_frames(CONVERSATION_FRAME_ROWS)
+        result = parse_result(response["output"])
+        if result is None:
+            # 达到步数上限或最终输出无法修复时，只多请求一次整理结果
+            count('result.reformat')
+            with stage('format_result'):
+                result = format_result(query, response["output"], response.get("intermediate_steps"), callbacks)
+        if result is None:
+            return dict(FALLBACK_RESULT)
+        if conversation is not None:
+            steps = [(action.tool_input, observation) for action, observation in response.get("intermediate_steps", [])
+                     if action.tool != "_Exception"]
+            conversation.add_turn(question, result, steps, frames)
+        return result
     except Exception as err:
         print(err)
-        return {"answer": "暂时无法提供分析结果，请稍后重试！"}
+        return dict(FALLBACK_RESULT)